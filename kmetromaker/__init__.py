@@ -0,0 +1,4 @@
+from .model import (Coordinate, TextDirection, SpatialGrid, NameTable, StationStore,
+                    LineStore, ConnectionStore, RiverStore, int2col, col2int, parse_color)
+from .fileformat import (load_file, save_file, save_file_v2, save_file_v3, save_file_v4,
+                         open_file_v1, open_file_v2, open_file_v3, open_file_v4)
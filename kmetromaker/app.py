@@ -0,0 +1,1179 @@
+import pygame, typing, tkinter.messagebox
+import tkinter.simpledialog, tkinter.filedialog
+import random, struct, os, sys, time, tempfile, contextlib, concurrent.futures
+import numpy as np
+from pathlib import Path
+from . import render, export, trace
+from .history import History, Edit
+from .config import config, resourcesPath, windowSize
+from .model import (Coordinate, TextDirection, grid, int2col, col2int, parse_color, set_root,
+                    StationStore, ConnectionStore, RiverStore, LineState, LineSnapshot, _view, _overlap)
+from .fileformat import save_file, load_file
+from .render import (Layer, mark_dirty, mark_dirty_rects, invalidate_labels, invalidate_tiles,
+                     draw_frame, station_rect, connection_rect, river_rect)
+
+stationSel: bool = False
+terminus: int = -1
+riverSel: bool = False
+riverBegin: Coordinate | None = None
+areaSel: bool = False
+areaBegin: Coordinate | None = None
+running: bool = True
+
+history: History = History(config.get("undoDepth", 100))
+bulkEdit: bool = False
+
+recorder: trace.Recorder | None = None
+replayer: trace.Replayer | None = None
+mousePos: tuple[int, int] = (0, 0)
+
+rightDown: bool = False
+rightDownAt: Coordinate = Coordinate()
+rightDownAt.set_pos(0, 0)
+orpan: Coordinate = render.pan.copy()
+
+progressRect: pygame.Rect = pygame.Rect(0, 0, 0, 0)
+progressShown: tuple[str, int] | None = None
+hudRect: pygame.Rect = pygame.Rect(0, 0, 0, 0)
+
+ioExecutor: concurrent.futures.ThreadPoolExecutor = concurrent.futures.ThreadPoolExecutor(1)
+ioTask: concurrent.futures.Future | None = None
+ioTitle: str = ""
+ioProgress: float | None = None
+ioDone: typing.Callable[[concurrent.futures.Future], None] | None = None
+
+def draw_progress(title: str, progress: float | None) -> None:
+    global progressRect
+    global progressShown
+
+    percent = -1 if progress is None else min(100, max(0, int(progress * 100)))
+    if (title, percent) == progressShown: return
+    progressShown = (title, percent)
+
+    progressRect = pygame.Rect(0, 0, 320, 72)
+    progressRect.center = render.window.get_rect().center
+    bar = pygame.Rect(progressRect.x + 16, progressRect.bottom - 28,
+                      progressRect.width - 32, 12)
+
+    pygame.draw.rect(render.window, (255, 255, 255), progressRect)
+    pygame.draw.rect(render.window, (0, 0, 0), progressRect, 2)
+    render.font.render_to(render.window, (progressRect.x + 16, progressRect.y + 14),
+                          title if percent < 0 else f"{title} {percent}%",
+                          fgcolor=(0, 0, 0), size=18)
+    pygame.draw.rect(render.window, (0, 0, 0), bar, 1)
+    if percent >= 0:
+        pygame.draw.rect(render.window, (0, 0, 0),
+                         (bar.x, bar.y, bar.width * percent // 100, bar.height))
+    pygame.display.update(progressRect)
+
+def draw_hud() -> pygame.Rect:
+    global hudRect
+
+    lines = render.profiler.summary()
+    hudRect = pygame.Rect(8, 8, 180, 16 * len(lines) + 12)
+    overlay = pygame.Surface(hudRect.size, pygame.SRCALPHA)
+    overlay.fill((0, 0, 0, 176))
+    for row, (name, value) in enumerate(lines):
+        render.font.render_to(overlay, (8, 8 + row * 16), name,
+                              fgcolor=(255, 255, 255), size=13)
+        rect = render.font.get_rect(value, size=13)
+        render.font.render_to(overlay, (hudRect.width - 8 - rect.width, 8 + row * 16), value,
+                              fgcolor=(255, 255, 255), size=13)
+    render.window.blit(overlay, hudRect)
+    return hudRect
+
+def toggle_hud() -> None:
+    render.profiler.hud = not render.profiler.hud
+    mark_dirty(hudRect, Layer(0))
+    if render.profiler.hud: mark_dirty(pygame.Rect(8, 8, 180, 16), Layer(0))
+
+def save_trace() -> None:
+    filename = ask(tkinter.filedialog.asksaveasfilename,
+        filetypes=[("CSV files", "*.csv"), ("Chrome trace files", "*.json")])
+
+    if not filename: return
+    if not filename.endswith((".csv", ".json")): filename += ".csv"
+
+    try:
+        if filename.endswith(".json"): render.profiler.write_trace(filename)
+        else: render.profiler.write_csv(filename)
+    except OSError as error:
+        ask(tkinter.messagebox.showerror, "Save failed",
+                                          f"The trace could not be saved: {error.strerror or error}")
+
+def clear_progress() -> None:
+    global progressShown
+    progressShown = None
+    mark_dirty(progressRect, Layer(0))
+
+def start_io(title: str, work: typing.Callable[[], typing.Any],
+             done: typing.Callable[[concurrent.futures.Future], None]) -> None:
+    global ioTask
+    global ioTitle
+    global ioProgress
+    global ioDone
+
+    ioTitle = title
+    ioProgress = None
+    ioDone = done
+    ioTask = ioExecutor.submit(work)
+    draw_progress(ioTitle, ioProgress)
+
+def finish_io() -> None:
+    global ioTask
+    task = ioTask
+    ioTask = None
+    clear_progress()
+    ioDone(task)
+
+def ask(dialog: typing.Callable[..., typing.Any], *args, **kwargs) -> typing.Any:
+    if replayer is not None: return replayer.answer(dialog.__name__)
+    answer = dialog(*args, **kwargs)
+    if recorder is not None: recorder.record_answer(dialog.__name__, answer)
+    return answer
+
+def usr_prompt_color(title: str, prompt: str) -> int | None:
+    color = ask(tkinter.simpledialog.askstring, title, prompt)
+    
+    if color is None: return
+
+    color = parse_color(color)
+
+    if color == -1:
+        ask(tkinter.messagebox.showerror, "Invalid color",
+                                              "The pallete color entered does not exist.")
+        return
+
+    if color == -2:
+        ask(tkinter.messagebox.showerror, "Invalid color",
+                                              "The color entered is invalid.")
+        return
+
+    return color
+
+def usr_coord_mouse() -> Coordinate:
+    where = Coordinate(0, 0)
+    where.set_root(render.window)
+    where.set_pos_whole(*mousePos)
+
+    where = where.copy(1 / render.zoom, True)
+    where -= render.pan.copy()
+
+    where.set_pos_grid(grid)
+    return where
+
+def find_station(where: Coordinate) -> int:
+    return render.stations.find(*where.get_pos())
+
+def find_connection(termini: tuple[int, int]) -> int:
+    found = render.connections.find_all(*termini)
+    return found[0] if found else -1
+
+def find_river(termini: tuple[Coordinate, Coordinate]) -> int:
+    return render.rivers.find(*termini[0].get_pos(), *termini[1].get_pos())
+
+@contextlib.contextmanager
+def bulk_edit(layers: Layer = Layer.ALL) -> typing.Iterator[None]:
+    global bulkEdit
+    outer = bulkEdit
+    bulkEdit = True
+    try:
+        yield
+    finally:
+        bulkEdit = outer
+        invalidate_tiles(layers=layers)
+        mark_dirty()
+
+def add_station(where: Coordinate, name: str,
+                dir: TextDirection = TextDirection.RIGHT) -> int:
+    station = render.stations.add(*where.get_pos(), name, dir)
+    if not bulkEdit: mark_dirty(station_rect(station), Layer.STATIONS)
+    history.push(("add_station", station, *where.get_pos(), name, dir))
+    return station
+
+def usr_add_station(*args, **kwargs) -> None:
+    where: Coordinate = usr_coord_mouse()
+
+    if find_station(where) >= 0: return
+
+    name = ask(tkinter.simpledialog.askstring, "Enter station name",
+                                             "What is the station name? (blank to cancel)")
+    
+    if name is None: return
+
+    add_station(where, name)
+
+def remove_stations(stations: typing.Iterable[int]) -> None:
+    global terminus
+    global stationSel
+
+    stations = sorted(set(stations), reverse=True)
+    connections = render.connections
+    edits: list[Edit] = []
+    with bulk_edit(Layer.STATIONS | Layer.CONNECTIONS) if len(stations) > 1 \
+            else contextlib.nullcontext():
+        for station in stations:
+            if not bulkEdit:
+                mark_dirty(station_rect(station), Layer.STATIONS)
+                for connIdx in connections.incident(station):
+                    mark_dirty(connection_rect(connections.termini(connIdx)), Layer.CONNECTIONS)
+            x, y = render.stations.pos(station)
+            name, dir = render.stations.names[station], render.stations.dir(station)
+
+            edits += [("set_line", *change) for change in connections.cut_station(station)]
+            _mark_moved()
+            last = render.stations.remove(station)
+            if last != station: connections.relabel(last, station)
+            _mark_moved()
+            edits.append(("remove_station", station, x, y, name, dir, last))
+            if terminus == station:
+                terminus = -1
+                stationSel = False
+            elif terminus == last:
+                terminus = station
+
+            if not bulkEdit and last != station:
+                mark_dirty(station_rect(station), Layer.STATIONS)
+    history.push(*edits)
+
+def restore_station(station: int, x: float, y: float, name: str, dir: TextDirection,
+                    last: int) -> None:
+    render.stations.restore(station, x, y, name, dir)
+    if last != station:
+        render.connections.relabel(station, last)
+        _mark_moved()
+        if not bulkEdit: mark_dirty(station_rect(last), Layer.STATIONS)
+    if not bulkEdit: mark_dirty(station_rect(station), Layer.STATIONS)
+
+def usr_remove_station(*args, **kwargs) -> None:
+    where: Coordinate = usr_coord_mouse()
+    station = find_station(where)
+
+    if station < 0: return
+    result = ask(tkinter.messagebox.askyesno,
+        "Remove station",
+        f"Are you sure you want to remove the station \"{render.stations.names[station]}\"?")
+    
+    if not result: return
+    remove_stations([station])
+
+def usr_remove_stations_area(*args, **kwargs) -> None:
+    global areaBegin
+    global areaSel
+
+    where: Coordinate = usr_coord_mouse()
+
+    if not areaSel:
+        areaBegin = where
+        areaSel = True
+        return
+
+    areaSel = False
+    found = render.stations.inside(*areaBegin.get_pos(), *where.get_pos())
+    areaBegin = None
+    if not len(found): return
+
+    result = ask(tkinter.messagebox.askyesno,
+        "Remove stations",
+        f"Are you sure you want to remove the {len(found)} stations in the selected area?")
+
+    if not result: return
+    remove_stations(found.tolist())
+
+def rename_station(station: int, name: str) -> None:
+    oldName = render.stations.names[station]
+    mark_dirty(station_rect(station), Layer.STATIONS)
+    invalidate_labels(oldName)
+    render.stations.rename(station, name)
+    mark_dirty(station_rect(station), Layer.STATIONS)
+    history.push(("rename_station", station, oldName, name))
+
+def redirect_station(station: int, dir: TextDirection) -> None:
+    oldDir = render.stations.dir(station)
+    mark_dirty(station_rect(station), Layer.STATIONS)
+    render.stations.dirs[station] = dir.value
+    mark_dirty(station_rect(station), Layer.STATIONS)
+    history.push(("redirect_station", station, oldDir, dir))
+
+def usr_rename_station(*args, **kwargs) -> None:
+    where: Coordinate = usr_coord_mouse()
+    station = find_station(where)
+
+    if station < 0: return
+
+    oldName = render.stations.names[station]
+
+    name = ask(tkinter.simpledialog.askstring,
+        "Enter new station name",
+        f"What is the new station name of \"{oldName}\"? (blank to cancel)")  
+    
+    if name is None: return
+    rename_station(station, name)
+
+def usr_change_text_dir_station(*args, **kwargs) -> None:
+    where: Coordinate = usr_coord_mouse()
+    station = find_station(where)
+
+    if station < 0: return
+
+    dir = ask(tkinter.simpledialog.askstring,
+        "Enter new station text direction",
+        "What is the new station text direction? (blank to cancel, any combination of LRUD is valid)") 
+
+    if not dir: return
+    dirFlag = TextDirection(0)
+    if "L" in dir: dirFlag |= TextDirection.LEFT
+    if "R" in dir: dirFlag |= TextDirection.RIGHT
+    if "U" in dir: dirFlag |= TextDirection.UP
+    if "D" in dir: dirFlag |= TextDirection.DOWN
+
+    if dirFlag == TextDirection(0):
+        return
+
+    redirect_station(station, dirFlag)
+
+def set_line(line: int, state: LineState | None) -> Edit:
+    old = render.connections.lines.get(line)
+    rects: list[pygame.Rect] = []
+    if not bulkEdit:
+        oldStops = old[0] if old else ()
+        newStops = tuple(state[0]) if state else ()
+        shift, lo, hi = _overlap(oldStops, newStops)
+        if old and state and old[1] != state[1]: lo = hi = 0
+        for stops, start, end in ((oldStops, lo, hi), (newStops, lo + shift, hi + shift)):
+            rects += [connection_rect(stops[stop:stop + 2])
+                      for stop in range(len(stops) - 1) if not start <= stop < end]
+    render.connections.set_line(line, state)
+    mark_dirty_rects(rects + _moved_rects(), Layer.CONNECTIONS)
+    return ("set_line", line, old, state)
+
+def _moved_rects() -> list[pygame.Rect]:
+    connections = render.connections
+    pairs, connections.moved = connections.moved, set()
+    if bulkEdit: return []
+    rects = []
+    for termini in pairs:
+        rects.append(connection_rect(termini))
+        for idx in connections.find_all(*termini):
+            rects += [connection_rect(connections.termini(other))
+                      for other in connections.neighbors(idx) if other >= 0]
+    return rects
+
+def _mark_moved() -> None:
+    mark_dirty_rects(_moved_rects(), Layer.CONNECTIONS)
+
+def set_lines(line: int, states: list[LineState]) -> list[Edit]:
+    edits = [set_line(line, states[0] if states else None)]
+    for state in states[1:]:
+        edits.append(set_line(len(render.connections.lines), state))
+    return edits
+
+def _without_segment(line: int, stop: int) -> list[LineState]:
+    stops, color, name = render.connections.lines.get(line)
+    if stops[0] == stops[-1]:
+        pieces = [stops[stop + 1:] + stops[1:stop + 1]]
+    else:
+        pieces = [stops[:stop + 1], stops[stop + 1:]]
+    return [(piece, color, name) for piece in pieces if len(piece) >= 2]
+
+def add_connection(termini: tuple[int, int], color: tuple[int, int, int]) -> int:
+    if termini[0] == termini[1]: return -1
+    connections = render.connections
+    color = col2int(color)
+    for connIdx in connections.incident(termini[0]):
+        line = connections.line[connIdx]
+        stops, lineColor, name = connections.lines.get(line)
+        if lineColor != color: continue
+        if stops[-1] == termini[0] and stops[-2] != termini[1]:
+            history.push(set_line(line, (stops + (termini[1],), color, name)))
+            return connections.segment(line, len(stops) - 1)
+        if stops[0] == termini[0] and stops[1] != termini[1]:
+            history.push(set_line(line, ((termini[1],) + stops, color, name)))
+            return connections.segment(line, 0)
+
+    line = len(connections.lines)
+    history.push(set_line(line, (tuple(termini), color, "")))
+    return connections.segment(line, 0)
+
+def remove_connection(connIdx: int) -> None:
+    connections = render.connections
+    line = connections.line[connIdx]
+    history.push(*set_lines(line, _without_segment(line, connections.stop[connIdx])))
+
+def recolor_connection(connIdx: int, color: int) -> None:
+    connections = render.connections
+    line, stop = connections.line[connIdx], connections.stop[connIdx]
+    stops, _, name = connections.lines.get(line)
+    if len(stops) == 2:
+        history.push(set_line(line, (stops, color, name)))
+        return
+    edits = set_lines(line, _without_segment(line, stop))
+    edits.append(set_line(len(connections.lines), (stops[stop:stop + 2], color, name)))
+    history.push(*edits)
+
+def remove_line(line: int) -> None:
+    history.push(set_line(line, None))
+
+def recolor_line(line: int, color: int) -> None:
+    stops, _, name = render.connections.lines.get(line)
+    history.push(set_line(line, (stops, color, name)))
+
+def rename_line(line: int, name: str) -> None:
+    stops, color, _ = render.connections.lines.get(line)
+    history.push(set_line(line, (stops, color, name)))
+
+def usr_add_connection(*args, **kwargs) -> None:
+    global terminus
+    global stationSel
+    where: Coordinate = usr_coord_mouse()
+
+    station = find_station(where)
+    if station < 0: return
+
+    if not stationSel:
+        terminus = station
+        stationSel = True
+        return
+
+    stationSel = False
+    if terminus == station:
+        terminus = -1
+        return
+
+    color = usr_prompt_color(
+        "Enter connection color",
+        "What is the connection color? (blank to cancel)"
+    )
+    
+    if color is None: return
+
+    color = int2col(color)
+
+    add_connection((terminus, station), color)
+
+    terminus = -1
+
+def usr_remove_connection(*args, **kwargs) -> None:
+    global terminus
+    global stationSel
+
+    where: Coordinate = usr_coord_mouse()
+
+    station = find_station(where)
+    if station < 0: return
+
+    if not stationSel:
+        terminus = station
+        stationSel = True
+        return
+    
+    connIdx = find_connection((terminus, station))
+    if connIdx < 0: return
+
+    result = ask(tkinter.messagebox.askyesno,
+            "Remove connection",
+            "Are you sure you want to remove the connection between"
+            f"\"{render.stations.names[terminus]}\" and \"{render.stations.names[station]}\"?")
+    
+    if not result: return
+    remove_connection(connIdx)
+
+    terminus = -1
+    stationSel = False
+
+def usr_recolor_connection(*args, **kwargs) -> None:
+    global terminus
+    global stationSel
+
+    where: Coordinate = usr_coord_mouse()
+
+    station = find_station(where)
+    if station < 0: return
+
+    if not stationSel:
+        terminus = station
+        stationSel = True
+        return
+    
+    connIdx = find_connection((terminus, station))
+    if connIdx < 0: return
+
+    color = usr_prompt_color(
+        "Enter new connection color",
+        "What is the new connection color? (blank to cancel)"
+    )
+    
+    if color is None: return
+    
+    recolor_connection(connIdx, color)
+
+    terminus = -1
+    stationSel = False
+
+def usr_select_line() -> int:
+    global terminus
+    global stationSel
+
+    where: Coordinate = usr_coord_mouse()
+
+    station = find_station(where)
+    if station < 0: return -1
+
+    if not stationSel:
+        terminus = station
+        stationSel = True
+        return -1
+
+    connIdx = find_connection((terminus, station))
+    terminus = -1
+    stationSel = False
+    if connIdx < 0: return -1
+    return render.connections.line[connIdx]
+
+def _line_title(line: int) -> str:
+    stops, _, name = render.connections.lines.get(line)
+    if name: return f"the line \"{name}\""
+    return (f"the line from \"{render.stations.names[stops[0]]}\""
+            f" to \"{render.stations.names[stops[-1]]}\"")
+
+def usr_rename_line(*args, **kwargs) -> None:
+    line = usr_select_line()
+    if line < 0: return
+
+    name = ask(tkinter.simpledialog.askstring,
+        "Enter line name",
+        f"What is the new name of {_line_title(line)}? (blank to cancel)")
+
+    if not name: return
+    rename_line(line, name)
+
+def usr_recolor_line(*args, **kwargs) -> None:
+    line = usr_select_line()
+    if line < 0: return
+
+    color = usr_prompt_color(
+        "Enter new line color",
+        f"What is the new color of {_line_title(line)}? (blank to cancel)"
+    )
+
+    if color is None: return
+    recolor_line(line, color)
+
+def usr_remove_line(*args, **kwargs) -> None:
+    line = usr_select_line()
+    if line < 0: return
+
+    result = ask(tkinter.messagebox.askyesno,
+        "Remove line",
+        f"Are you sure you want to remove {_line_title(line)} and all of its connections?")
+
+    if not result: return
+    remove_line(line)
+
+def add_river(termini: tuple[Coordinate], color: tuple[int, int, int]) -> int:
+    if termini[0] == termini[1]: return -1
+    river = render.rivers.add(*termini[0].get_pos(), *termini[1].get_pos(), col2int(color))
+    mark_dirty(river_rect(river), Layer.RIVERS)
+    history.push(("add_river", river, *termini[0].get_pos(), *termini[1].get_pos(), col2int(color)))
+    return river
+
+def remove_river(rivIdx: int) -> None:
+    rivers = render.rivers
+    edit = ("remove_river", rivIdx, rivers.x1[rivIdx], rivers.y1[rivIdx],
+            rivers.x2[rivIdx], rivers.y2[rivIdx], rivers.colors[rivIdx])
+    mark_dirty(river_rect(rivIdx), Layer.RIVERS)
+    if rivers.remove(rivIdx) != rivIdx:
+        mark_dirty(river_rect(rivIdx), Layer.RIVERS)
+    history.push(edit)
+
+def restore_river(rivIdx: int, x1: float, y1: float, x2: float, y2: float, color: int) -> None:
+    render.rivers.restore(rivIdx, x1, y1, x2, y2, color)
+    for moved in {rivIdx, len(render.rivers) - 1}:
+        mark_dirty(river_rect(moved), Layer.RIVERS)
+
+def recolor_river(rivIdx: int, color: int) -> None:
+    oldColor = render.rivers.colors[rivIdx]
+    render.rivers.colors[rivIdx] = color
+    mark_dirty(river_rect(rivIdx), Layer.RIVERS)
+    history.push(("recolor_river", rivIdx, oldColor, color))
+
+def usr_add_river(*args, **kwargs) -> None:
+    global riverBegin
+    global riverSel
+    where: Coordinate = usr_coord_mouse()
+
+    if not riverSel:
+        riverBegin = where
+        riverSel = True
+        return
+
+    riverSel = False
+    if riverBegin == where:
+        riverBegin = None
+        return
+
+    color = color = usr_prompt_color(
+        "Enter river color",
+        "What is the river color? (blank to cancel)"
+    )
+    
+    if color is None: return
+
+    color = int2col(color)
+
+    add_river(
+        (riverBegin, where), color
+    )
+
+    riverBegin = None
+
+def usr_remove_river(*args, **kwargs) -> None:
+    global riverBegin
+    global riverSel
+
+    where: Coordinate = usr_coord_mouse()
+
+    if not riverSel:
+        riverBegin = where
+        riverSel = True
+        return
+
+    riverSel = False
+    if riverBegin == where:
+        riverBegin = None
+        return
+    
+    rivIdx = find_river((
+        riverBegin, where
+    ))
+    if rivIdx < 0: return
+
+    result = ask(tkinter.messagebox.askyesno,
+            "Remove river",
+            "Are you sure you want to remove the river between"
+            f"\"{riverBegin}\" and \"{where}\"?")
+    
+    if not result: return
+    remove_river(rivIdx)
+
+    riverBegin = None
+
+def usr_recolor_river(*args, **kwargs) -> None:
+    global riverBegin
+    global riverSel
+
+    where: Coordinate = usr_coord_mouse()
+
+    if not riverSel:
+        riverBegin = where
+        riverSel = True
+        return
+
+    riverSel = False
+    if riverBegin == where:
+        riverBegin = None
+        return
+    
+    rivIdx = find_river((
+        riverBegin, where
+    ))
+    if rivIdx < 0: return
+
+    color = usr_prompt_color(
+        "Enter new river color",
+        "What is the new river color? (blank to cancel)"
+    )
+    
+    if color is None: return
+    
+    recolor_river(rivIdx, color)
+
+    riverBegin = None
+
+def extreme_connect() -> None:
+    xs = _view(render.stations.x)
+    ys = _view(render.stations.y)
+    s1, s2 = np.triu_indices(len(xs), 1)
+    apart = (xs[s1] != xs[s2]) | (ys[s1] != ys[s2])
+    s1, s2 = s1[apart], s2[apart]
+    colors = np.random.default_rng(random.getrandbits(64)).integers(
+        0, 1 << 24, len(s1), dtype=np.uint32)
+
+    old = render.connections.snapshot()
+    replace_connections(s1, s2, colors)
+    history.push(("replace_connections", old, (s1, s2, colors)))
+
+def replace_connections(a: np.ndarray, b: np.ndarray, colors: np.ndarray) -> None:
+    render.connections.clear()
+    render.connections.extend(a, b, colors)
+
+    invalidate_tiles(layers=Layer.CONNECTIONS)
+    mark_dirty()
+
+def replace_lines(snapshot: LineSnapshot) -> None:
+    render.connections.load(snapshot)
+
+    invalidate_tiles(layers=Layer.CONNECTIONS)
+    mark_dirty()
+
+undoEdits: dict[str, typing.Callable[..., None]] = {
+    "add_station": lambda station, *_: remove_stations([station]),
+    "remove_station": restore_station,
+    "rename_station": lambda station, old, new: rename_station(station, old),
+    "redirect_station": lambda station, old, new: redirect_station(station, old),
+    "set_line": lambda line, old, new: set_line(line, old),
+    "add_river": lambda rivIdx, *_: remove_river(rivIdx),
+    "remove_river": restore_river,
+    "recolor_river": lambda rivIdx, old, new: recolor_river(rivIdx, old),
+    "replace_connections": lambda old, new: replace_lines(old),
+}
+
+redoEdits: dict[str, typing.Callable[..., None]] = {
+    "add_station": lambda station, x, y, name, dir: add_station(Coordinate(x, y), name, dir),
+    "remove_station": lambda station, *_: remove_stations([station]),
+    "rename_station": lambda station, old, new: rename_station(station, new),
+    "redirect_station": lambda station, old, new: redirect_station(station, new),
+    "set_line": lambda line, old, new: set_line(line, new),
+    "add_river": lambda rivIdx, x1, y1, x2, y2, color: add_river(
+        (Coordinate(x1, y1), Coordinate(x2, y2)), int2col(color)),
+    "remove_river": lambda rivIdx, *_: remove_river(rivIdx),
+    "recolor_river": lambda rivIdx, old, new: recolor_river(rivIdx, new),
+    "replace_connections": lambda old, new: replace_connections(*new),
+}
+
+def replay_edits(edits: typing.Sequence[Edit], table: dict[str, typing.Callable[..., None]]) -> None:
+    global terminus
+    global stationSel
+    global riverSel
+    global areaSel
+
+    terminus = -1
+    stationSel = False
+    riverSel = False
+    areaSel = False
+    with history.replay(), bulk_edit() if len(edits) > 1 else contextlib.nullcontext():
+        for kind, *data in edits:
+            table[kind](*data)
+
+def undo() -> None:
+    edits = history.undo()
+    if edits is not None: replay_edits(edits[::-1], undoEdits)
+
+def redo() -> None:
+    edits = history.redo()
+    if edits is not None: replay_edits(edits, redoEdits)
+
+def usr_extreme_connect() -> None:
+    result = ask(tkinter.messagebox.askyesno,
+        "Extreme connect",
+        "Are you sure you want to connect ALL stations to each other?",
+        icon=tkinter.messagebox.WARNING
+    )
+    
+    if not result: return
+
+    result = ask(tkinter.messagebox.askyesno,
+        "Are you REALLY SURE?",
+        "This WILL connect all stations to each other and ruin your work!",
+        icon=tkinter.messagebox.WARNING
+    )
+
+    if not result: return
+
+    extreme_connect()
+
+def _report_progress(progress: float) -> None:
+    global ioProgress
+    ioProgress = progress
+
+def save_file_done(task: concurrent.futures.Future) -> None:
+    try:
+        task.result()
+    except OSError as error:
+        ask(tkinter.messagebox.showerror, "Save failed",
+                                          f"The file could not be saved: {error.strerror or error}")
+
+def saveas_file() -> None:
+    if ioTask is not None: return
+    filename = ask(tkinter.filedialog.asksaveasfilename,
+        filetypes=[("KMetroMaker files", "*.kmm")])
+    
+    if not filename: return
+    if not filename.endswith(".kmm"): filename += ".kmm"
+
+    render.stations.names.materialize()
+    model = (render.stations, render.connections, render.rivers)
+    start_io("Saving...", lambda: save_file(filename, model, progress=_report_progress),
+             save_file_done)
+
+def open_file_done(task: concurrent.futures.Future) -> None:
+    global terminus
+    global stationSel
+    global riverSel
+
+    try:
+        model = task.result()
+    except (ValueError, IndexError, struct.error):
+        ask(tkinter.messagebox.showerror, "Invalid file",
+                                          "The file selected is corrupted or incomplete.")
+        return
+    if model is None:
+        ask(tkinter.messagebox.showerror, "Invalid file",
+                                          "The file selected is not a valid KMetroMaker file.")
+        return
+
+    render.set_model(model)
+    history.clear()
+
+    terminus = -1
+    stationSel = False
+    riverSel = False
+    orpan.set_pos(0, 0)
+    render.pan.set_pos(0, 0)
+
+def open_file() -> None:
+    if ioTask is not None: return
+    filename = ask(tkinter.filedialog.askopenfilename,
+        filetypes=[("KMetroMaker files", "*.kmm")])
+    
+    if not filename: return
+
+    start_io("Loading...", lambda: load_file(filename), open_file_done)
+
+def export_done(task: concurrent.futures.Future) -> None:
+    try:
+        task.result()
+    except ValueError as error:
+        ask(tkinter.messagebox.showerror, "Export failed", f"The map could not be exported: {error}.")
+    except OSError as error:
+        ask(tkinter.messagebox.showerror, "Export failed",
+                                          f"The image could not be saved: {error.strerror or error}")
+
+def export_map(filename: str, size: tuple[int, int],
+               model: tuple[StationStore, ConnectionStore, RiverStore]) -> None:
+    fd, source = tempfile.mkstemp(suffix=".kmm")
+    os.close(fd)
+    try:
+        save_file(source, model)
+        export.export_png(filename, size, progress=_report_progress,
+                          source=source, jobs=min(export.exportJobs, os.cpu_count() or 1))
+    finally:
+        Path(source).unlink(missing_ok=True)
+
+def export_image_file() -> None:
+    if ioTask is not None: return
+    filename = ask(tkinter.filedialog.asksaveasfilename,
+        filetypes=[("PNG files", "*.png")])
+    
+    if not filename: return
+    if not filename.endswith(".png"): filename += ".png"
+
+    size = ask(tkinter.simpledialog.askstring,
+        "Image size", "Size of the whole map as WIDTHxHEIGHT (leave blank to export the current view):")
+    if size is None: return
+    if not size.strip():
+        pygame.image.save(render.window, filename)
+        return
+
+    try:
+        size = export.parse_size(size)
+    except ValueError:
+        ask(tkinter.messagebox.showerror, "Invalid size",
+                                          "The size entered is invalid, use WIDTHxHEIGHT.")
+        return
+
+    render.stations.names.materialize()
+    model = (render.stations, render.connections, render.rivers)
+    start_io("Exporting...", lambda: export_map(filename, size, model), export_done)
+
+def handle_skeys(keys: pygame.key.ScancodeWrapper) -> None:
+    if keys[pygame.K_r]:
+        usr_remove_station()
+        return
+    if keys[pygame.K_x]:
+        usr_remove_stations_area()
+        return
+    if keys[pygame.K_n]:
+        usr_rename_station()
+        return
+    if keys[pygame.K_d]:
+        usr_change_text_dir_station()
+        return
+    usr_add_station()
+    return
+
+def handle_ckeys(keys: pygame.key.ScancodeWrapper) -> None:
+    if keys[pygame.K_r]:
+        usr_remove_connection()
+        return
+    if keys[pygame.K_n]:
+        usr_recolor_connection()
+        return
+    usr_add_connection()
+    return
+
+def handle_vkeys(keys: pygame.key.ScancodeWrapper) -> None:
+    if keys[pygame.K_r]:
+        usr_remove_river()
+        return
+    if keys[pygame.K_n]:
+        usr_recolor_river()
+        return
+    usr_add_river()
+    return
+
+def handle_lkeys(keys: pygame.key.ScancodeWrapper) -> None:
+    if keys[pygame.K_r]:
+        usr_remove_line()
+        return
+    if keys[pygame.K_n]:
+        usr_recolor_line()
+        return
+    usr_rename_line()
+    return
+
+def handle_keys_left(keys: pygame.key.ScancodeWrapper) -> None:
+    if keys[pygame.K_LALT] or keys[pygame.K_RALT]:
+        if keys[pygame.K_l]:
+            handle_lkeys(keys)
+            return
+        if keys[pygame.K_c]:
+            handle_ckeys(keys)
+            return
+        if keys[pygame.K_s]:
+            handle_skeys(keys)
+            return  
+        if keys[pygame.K_v]:
+            handle_vkeys(keys)
+            return  
+
+def scroll_right(mousePos: Coordinate) -> None:
+    render.pan = orpan + (mousePos - rightDownAt)
+    mark_dirty()
+
+def handle_keys_keyboard(keys: pygame.key.ScancodeWrapper) -> None:
+    if keys[pygame.K_F3]:
+        if keys[pygame.K_LCTRL] or keys[pygame.K_RCTRL]: save_trace()
+        else: toggle_hud()
+        return
+    if keys[pygame.K_LCTRL] or keys[pygame.K_RCTRL]:
+        if keys[pygame.K_z]:
+            if keys[pygame.K_LSHIFT] or keys[pygame.K_RSHIFT]: redo()
+            else: undo()
+            return
+        if keys[pygame.K_y]:
+            redo()
+            return
+        if keys[pygame.K_COMMA]:
+            usr_extreme_connect()
+            return
+        if keys[pygame.K_s]:
+            saveas_file()
+            return
+        if keys[pygame.K_o]:
+            open_file()
+            return
+        if keys[pygame.K_e]:
+            export_image_file()
+            return
+        if keys[pygame.K_MINUS]:
+            render.zoom /= 2
+            if render.zoom < 0.03125: render.zoom = 0.03125
+            invalidate_labels()
+            mark_dirty()
+            return
+        if keys[pygame.K_PLUS] or (
+            (keys[pygame.K_EQUALS] and 
+                (keys[pygame.K_LCTRL] or keys[pygame.K_RCTRL])
+            )
+        ):
+            render.zoom *= 2
+            if render.zoom > 32: render.zoom = 32
+            invalidate_labels()
+            mark_dirty()
+            return
+        if keys[pygame.K_0]:
+            render.zoom = 1
+            render.pan.set_pos(0, 0)
+            orpan.set_pos(0, 0)
+            invalidate_labels()
+            mark_dirty()
+            return
+        return
+
+def handle_events_and_keys(block: bool = False, timeout: int = 0) -> None:
+    with render.profiler.phase("idle"):
+        get = [pygame.event.wait(timeout)] if block else []
+    get += pygame.event.get()
+    keys = pygame.key.get_pressed()
+    mousebuttons = pygame.mouse.get_pressed()
+    pos = pygame.mouse.get_pos()
+
+    if recorder is not None: recorder.record_input(get, keys, mousebuttons, pos)
+    handle_input(get, keys, mousebuttons, pos)
+
+def handle_input(get: list[pygame.event.Event], keys: pygame.key.ScancodeWrapper,
+                 mousebuttons: tuple[bool, ...], pos: tuple[int, int]) -> None:
+    global running
+    global rightDown
+    global rightDownAt
+    global orpan
+    global mousePos
+
+    mousePos = pos
+    mouseAt = Coordinate()
+    mouseAt.set_root(render.window)
+    mouseAt.set_pos_whole(*pos)
+
+    for event in get:
+        if event.type == pygame.QUIT:
+            running = False
+            return
+
+        if event.type in (pygame.WINDOWEXPOSED, pygame.WINDOWRESTORED,
+                          pygame.WINDOWSIZECHANGED, pygame.VIDEOEXPOSE):
+            mark_dirty()
+            continue
+        
+        if event.type == pygame.KEYDOWN:
+            if ioTask is None: handle_keys_keyboard(keys)
+            continue
+
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            if mousebuttons[0]: continue
+            orpan = render.pan.copy()
+            rightDownAt = mouseAt.copy()
+            rightDown = True
+            continue
+
+        if event.type == pygame.MOUSEBUTTONUP:
+            if ioTask is None: handle_keys_left(keys)
+            orpan = render.pan.copy()
+            rightDownAt = None
+            rightDown = False
+            continue
+
+        if event.type == pygame.MOUSEMOTION:
+            if mousebuttons[0]: continue
+            if mousebuttons[2] and rightDown:
+                scroll_right(mouseAt)
+                continue
+            continue
+
+def render_frame() -> None:
+    global progressShown
+
+    if render.profiler.hud: mark_dirty(hudRect, Layer(0))
+    rects = draw_frame()
+
+    with render.profiler.phase("overlay"):
+        if ioTask is not None:
+            progressShown = None
+            draw_progress(ioTitle, ioProgress)
+        if render.profiler.hud:
+            shown = draw_hud()
+            if rects is not None: rects.append(shown)
+
+    with render.profiler.phase("flip"):
+        if rects is None:
+            pygame.display.flip()
+        else:
+            pygame.display.update(rects)
+
+def init() -> None:
+    global orpan
+
+    pygame.init()
+
+    window = pygame.display.set_mode(windowSize)
+    icon = pygame.image.load(str(
+        resourcesPath.joinpath("icon.png")))
+    icon = pygame.transform.scale(icon, (512, 512))
+
+    pygame.display.set_caption("KMetroMaker")
+    pygame.display.set_icon(icon)
+
+    if config.get("splashScreen", True):
+        rect = icon.get_rect()
+        rect.center = window.get_rect().center
+
+        window.fill((255, 255, 255))
+        window.blit(icon, rect)
+
+        pygame.display.flip()
+
+    set_root(window)
+    render.init(window, config.get("tileCache", True))
+    orpan = render.pan.copy()
+
+def main(record: str | None = None) -> None:
+    global recorder
+
+    init()
+    if record is not None:
+        seed = random.getrandbits(64)
+        random.seed(seed)
+        recorder = trace.Recorder(record, seed)
+
+    while running:
+        render.profiler.begin_frame()
+        if ioTask is not None:
+            if not ioTask.done(): draw_progress(ioTitle, ioProgress)
+            else:
+                if recorder is not None: recorder.record_io()
+                finish_io()
+
+        if render.redrawAll or render.dirtyRects or not render.redrawOnDemand:
+            render_frame()
+
+        with render.profiler.phase("events"):
+            if ioTask is not None:
+                handle_events_and_keys(True, 50)
+            else:
+                handle_events_and_keys(render.redrawOnDemand and not (render.redrawAll or render.dirtyRects))
+        render.profiler.end_frame()
+
+    if recorder is not None: recorder.close()
+    ioExecutor.shutdown(wait=False, cancel_futures=True)
+    invalidate_tiles()
+    pygame.quit()
+
+def replay(filename: str, report: str | None = None) -> int:
+    global replayer
+
+    try:
+        replayer = trace.Replayer(filename)
+    except (OSError, ValueError, KeyError) as error:
+        print(f"{filename}: not a KMetroMaker trace ({error})", file=sys.stderr)
+        return 1
+
+    render.init_headless()
+    init()
+    random.seed(replayer.seed)
+    start = time.perf_counter()
+    try:
+        while replayer and running:
+            record = replayer.next()
+            if "io" in record:
+                if ioTask is not None:
+                    concurrent.futures.wait([ioTask])
+                    finish_io()
+                continue
+            if "events" not in record: continue
+
+            begin = time.perf_counter()
+            handle_input(*replayer.input(record))
+            if render.redrawAll or render.dirtyRects or not render.redrawOnDemand:
+                render_frame()
+            replayer.measure(record, time.perf_counter() - begin)
+    except ValueError as error:
+        print(f"{filename}: the replay went differently from the recording ({error})", file=sys.stderr)
+        return 1
+    finally:
+        ioExecutor.shutdown(wait=True, cancel_futures=True)
+        invalidate_tiles()
+        pygame.quit()
+
+    print("\n".join(replayer.report(time.perf_counter() - start)))
+    if report is not None: replayer.write_csv(report)
+    return 0
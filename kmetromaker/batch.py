@@ -0,0 +1,101 @@
+import pygame, sys, os, struct, argparse, multiprocessing
+import concurrent.futures
+from pathlib import Path
+from . import render, export
+from .config import windowSize
+from .fileformat import load_file
+
+def _parse_size(size: str) -> tuple[int, int]:
+    try:
+        return export.parse_size(size)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size {size!r}, expected WIDTHxHEIGHT")
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="metro.py", description="Create metro maps, or render .kmm files to PNG.")
+    parser.add_argument("--render", nargs="+", metavar="FILE",
+                        help="render these .kmm files to PNG without opening a window")
+    parser.add_argument("-o", "--output", default=".", metavar="DIR",
+                        help="directory to write rendered PNGs to (default: current directory)")
+    parser.add_argument("--size", type=_parse_size, metavar="WIDTHxHEIGHT",
+                        help="size of the rendered images (default: the window size)")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="zoom level to render at (default: 1)")
+    parser.add_argument("--fit", action="store_true",
+                        help="render the whole map to fit --size instead of the window view")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="number of maps to render in parallel (default: number of CPUs)")
+    parser.add_argument("--record", metavar="TRACE",
+                        help="record the input events and dialog answers of this session to TRACE")
+    parser.add_argument("--replay", metavar="TRACE",
+                        help="replay a recorded TRACE without a window and report how long each event took")
+    parser.add_argument("--report", metavar="CSV",
+                        help="with --replay, also write the latency of every event to CSV")
+    return parser.parse_args(argv)
+
+def render_map(filename: str, output: str, size: tuple[int, int], scale: float,
+               fit: bool = False, jobs: int = 1) -> str | None:
+    render.init_headless()
+
+    try:
+        model = load_file(filename)
+    except (ValueError, IndexError, struct.error):
+        return f"{filename}: the file is corrupted or incomplete"
+    except OSError as error:
+        return f"{filename}: {error.strerror or error}"
+    if model is None:
+        return f"{filename}: not a valid KMetroMaker file"
+
+    render.init(pygame.Surface((1, 1)))
+    render.set_model(model)
+    render.zoom = scale
+    render.pan.set_pos(0, 0)
+    render.canvasSize = windowSize
+    try:
+        if fit:
+            export.export_png(output, size, source=filename if jobs > 1 else None, jobs=jobs)
+        else:
+            render.invalidate_labels()
+            width, height = windowSize
+            image, = render.draw_canvas(size, ((width - size[0]) // 2, (height - size[1]) // 2))
+            pygame.image.save(image, output)
+    except ValueError as error:
+        return f"{filename}: {error}"
+    except (OSError, pygame.error) as error:
+        return f"{output}: {error}"
+    finally:
+        render.stations.clear()
+    return None
+
+def render_batch(arguments: argparse.Namespace) -> int:
+    size = arguments.size or windowSize
+    output = Path(arguments.output)
+    jobs = [(filename, str(output.joinpath(Path(filename).stem + ".png")), size,
+             arguments.scale, arguments.fit)
+            for filename in arguments.render]
+
+    sources: dict[str, str] = {}
+    for filename, png, *_ in jobs:
+        if png in sources:
+            print(f"{sources[png]} and {filename} would both be rendered to {png}; "
+                  f"rename one of them or render them separately", file=sys.stderr)
+            return 1
+        sources[png] = filename
+    output.mkdir(parents=True, exist_ok=True)
+
+    if len(jobs) == 1:
+        errors = [render_map(*jobs[0], arguments.jobs)]
+    elif arguments.jobs <= 1:
+        errors = [render_map(*job) for job in jobs]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(
+                min(arguments.jobs, len(jobs)),
+                mp_context=multiprocessing.get_context("spawn")) as pool:
+            errors = list(pool.map(render_map, *zip(*jobs)))
+
+    for (filename, png, *_), error in zip(jobs, errors):
+        if error is None: print(f"{filename} -> {png}")
+        else: print(error, file=sys.stderr)
+    if pygame.get_init(): pygame.quit()
+    return 1 if any(errors) else 0
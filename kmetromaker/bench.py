@@ -0,0 +1,310 @@
+import pygame, sys, io, math, time, json, typing, argparse, platform, statistics
+import tempfile, tracemalloc, datetime
+import numpy as np
+from pathlib import Path
+from . import render, app
+from .config import windowSize
+from .model import TextDirection, StationStore, ConnectionStore, RiverStore
+from .fileformat import (save_file, save_file_v2, save_file_v3, save_file_v4,
+                         open_file_v2, open_file_v3, open_file_v4)
+
+BENCH_VERSION = 2
+
+mapKinds: tuple[str, ...] = ("grid", "radial", "random")
+stationsPerWindow: int = 200
+benchmarks: dict[str, typing.Callable[..., tuple[typing.Callable[[], typing.Any], int, str]]] = {}
+
+def _benchmark(function: typing.Callable) -> typing.Callable:
+    benchmarks[function.__name__.removeprefix("bench_")] = function
+    return function
+
+def _grid_map(size: int, rng: np.random.Generator) -> tuple[np.ndarray, ...]:
+    side = math.ceil(math.sqrt(size))
+    idx = np.arange(size)
+    xs = 0.05 + 0.9 * (idx % side) / max(1, side - 1)
+    ys = 0.05 + 0.9 * (idx // side) / max(1, side - 1)
+    right = idx[(idx % side < side - 1) & (idx + 1 < size)]
+    down = idx[idx + side < size]
+    return (xs, ys, np.concatenate((right, down)), np.concatenate((right + 1, down + side)),
+            np.concatenate((right // side, side + down % side)))
+
+def _radial_map(size: int, rng: np.random.Generator) -> tuple[np.ndarray, ...]:
+    spokes = max(3, math.ceil(math.sqrt(size)))
+    idx = np.arange(size)
+    ring = idx // spokes + 1
+    angle = 2 * math.pi * (idx % spokes) / spokes
+    radius = 0.45 * ring / ring[-1]
+    xs = 0.5 + radius * np.cos(angle)
+    ys = 0.5 + radius * np.sin(angle)
+    around = idx[(idx % spokes < spokes - 1) & (idx + 1 < size)]
+    outward = idx[idx + spokes < size]
+    return (xs, ys, np.concatenate((around, outward)), np.concatenate((around + 1, outward + spokes)),
+            np.concatenate((around // spokes, ring[-1] + outward % spokes)))
+
+def _random_map(size: int, rng: np.random.Generator) -> tuple[np.ndarray, ...]:
+    xs = rng.random(size)
+    ys = rng.random(size)
+    order = np.argsort(xs, kind="stable")
+    near = np.minimum(np.arange(1, size) + rng.integers(0, 16, max(0, size - 1)), size - 1)
+    return xs, ys, order[:-1], order[near], np.arange(max(0, size - 1))
+
+def generate_map(kind: str, size: int,
+                 seed: int = 0) -> tuple[StationStore, ConnectionStore, RiverStore]:
+    rng = np.random.default_rng(seed)
+    xs, ys, a, b, lines = {"grid": _grid_map, "radial": _radial_map,
+                           "random": _random_map}[kind](size, rng)
+    keep = a != b
+    a, b, lines = a[keep], b[keep], lines[keep]
+    extent = _extent(size)
+    xs = 0.5 + (xs - 0.5) * extent
+    ys = 0.5 + (ys - 0.5) * extent
+
+    stations = StationStore()
+    stations.x.frombytes(np.asarray(xs, np.float64).tobytes())
+    stations.y.frombytes(np.asarray(ys, np.float64).tobytes())
+    stations.dirs.frombytes(np.full(size, TextDirection.RIGHT.value, np.uint8).tobytes())
+    for station in range(size):
+        stations.names.append(f"{kind.title()} {station}")
+    stations.reindex()
+
+    connections = ConnectionStore(stations)
+    palette = rng.integers(0, 1 << 24, int(lines.max(initial=0)) + 1, dtype=np.uint32)
+    connections.extend(a, b, palette[lines])
+
+    rivers = RiverStore()
+    count = min(100, max(1, size // 1000))
+    for column in (rivers.x1, rivers.y1, rivers.x2, rivers.y2):
+        column.frombytes((0.5 + (rng.random(count) - 0.5) * extent).tobytes())
+    rivers.colors.frombytes(np.full(count, 0x3080FF, np.uint32).tobytes())
+    rivers.reindex()
+    return stations, connections, rivers
+
+def _extent(size: int) -> float:
+    return max(1, math.sqrt(size / stationsPerWindow))
+
+def _show(zoom: float) -> None:
+    render.zoom = zoom
+    render.pan.set_pos(0, 0)
+    render.invalidate_labels()
+    render.mark_dirty()
+
+@_benchmark
+def bench_find_station(model: tuple, rng: np.random.Generator, workdir: Path):
+    stations = model[0]
+    picks = rng.integers(0, len(stations), 10000)
+    points = [stations.pos(station) for station in picks.tolist()]
+    return lambda: [app.find_station(app.Coordinate(x, y)) for x, y in points], len(points), "lookups"
+
+@_benchmark
+def bench_frame(model: tuple, rng: np.random.Generator, workdir: Path):
+    _show(1)
+    render.draw_frame()
+    return lambda: (render.mark_dirty(), render.draw_frame()), 1, "frames"
+
+@_benchmark
+def bench_frame_cold(model: tuple, rng: np.random.Generator, workdir: Path):
+    def frame() -> None:
+        _show(1)
+        render.draw_frame()
+    return frame, 1, "frames"
+
+@_benchmark
+def bench_frame_overview(model: tuple, rng: np.random.Generator, workdir: Path):
+    _show(1 / _extent(len(model[0])))
+    render.draw_frame()
+    return lambda: (render.mark_dirty(), render.draw_frame()), 1, "frames"
+
+@_benchmark
+def bench_extreme_connect(model: tuple, rng: np.random.Generator, workdir: Path):
+    if len(model[0]) > 1000: return None
+    def connect() -> None:
+        app.extreme_connect()
+        app.history.clear()
+    return connect, len(model[0]) * (len(model[0]) - 1) // 2, "pairs"
+
+def _save_bench(writer: typing.Callable, model: tuple, workdir: Path, name: str):
+    target = workdir.joinpath(name)
+    def save() -> None:
+        save_file(str(target), model, writer=writer)
+    save()
+    return save, target.stat().st_size, "bytes"
+
+def _load_bench(opener: typing.Callable, writer: typing.Callable, model: tuple):
+    buffer = io.BytesIO()
+    for _ in writer(buffer, model): pass
+    data = buffer.getvalue()
+    return lambda: opener(data), len(data), "bytes"
+
+@_benchmark
+def bench_save_v4(model: tuple, rng: np.random.Generator, workdir: Path):
+    return _save_bench(save_file_v4, model, workdir, "bench4.kmm")
+
+@_benchmark
+def bench_load_v4(model: tuple, rng: np.random.Generator, workdir: Path):
+    return _load_bench(open_file_v4, save_file_v4, model)
+
+@_benchmark
+def bench_save_v3(model: tuple, rng: np.random.Generator, workdir: Path):
+    return _save_bench(save_file_v3, model, workdir, "bench.kmm")
+
+@_benchmark
+def bench_load_v3(model: tuple, rng: np.random.Generator, workdir: Path):
+    return _load_bench(open_file_v3, save_file_v3, model)
+
+@_benchmark
+def bench_save_v2(model: tuple, rng: np.random.Generator, workdir: Path):
+    return _save_bench(save_file_v2, model, workdir, "bench2.kmm")
+
+@_benchmark
+def bench_load_v2(model: tuple, rng: np.random.Generator, workdir: Path):
+    return _load_bench(open_file_v2, save_file_v2, model)
+
+def _measure(work: typing.Callable[[], typing.Any], repeat: int,
+             budget: float) -> list[float]:
+    times: list[float] = []
+    while len(times) < repeat and (not times or sum(times) < budget):
+        start = time.perf_counter()
+        work()
+        times.append(time.perf_counter() - start)
+    return times
+
+def _peak_memory(work: typing.Callable[[], typing.Any]) -> int:
+    tracemalloc.start()
+    try:
+        work()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def run(kinds: typing.Iterable[str], sizes: typing.Iterable[int], names: typing.Iterable[str],
+        repeat: int = 5, budget: float = 10, seed: int = 0, memory: bool = True,
+        log: typing.Callable[[str], None] = print) -> list[dict[str, typing.Any]]:
+    render.init_headless()
+    render.init(pygame.Surface(windowSize))
+    results: list[dict[str, typing.Any]] = []
+
+    with tempfile.TemporaryDirectory(prefix="kmetromaker-bench-") as workdir:
+        for kind in kinds:
+            for size in sizes:
+                model = generate_map(kind, size, seed)
+                render.set_model(model)
+                for name in sorted(names, key=lambda name: name == "extreme_connect"):
+                    setup = benchmarks[name](model, np.random.default_rng(seed), Path(workdir))
+                    if setup is None: continue
+                    work, count, unit = setup
+                    times = _measure(work, repeat, budget)
+                    result = {"benchmark": name, "map": kind, "size": size,
+                              "runs": len(times), "min": min(times),
+                              "median": statistics.median(times),
+                              "count": count, "unit": unit,
+                              "rate": count / max(min(times), 1e-9),
+                              "peak": _peak_memory(work) if memory else None}
+                    results.append(result)
+                    log(_format(result))
+    return results
+
+def _format(result: dict[str, typing.Any]) -> str:
+    peak = "" if result["peak"] is None else f"  peak {result['peak'] / 1048576:8.1f} MB"
+    return (f"{result['benchmark']:<16} {result['map']:<7} {result['size']:>8}"
+            f"  {result['min'] * 1000:10.2f} ms  {result['rate']:14.1f} {result['unit']}/s{peak}")
+
+def write_results(filename: str, results: list[dict[str, typing.Any]]) -> None:
+    report = {"version": BENCH_VERSION,
+              "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+              "python": platform.python_version(),
+              "pygame": pygame.version.ver,
+              "numpy": np.__version__,
+              "platform": platform.platform(),
+              "results": results}
+    Path(filename).write_text(json.dumps(report, indent=1))
+
+def compare(results: list[dict[str, typing.Any]], baseline: list[dict[str, typing.Any]],
+            tolerance: float) -> list[str]:
+    old = {(result["benchmark"], result["map"], result["size"]): result for result in baseline}
+    regressions: list[str] = []
+    for result in results:
+        before = old.get((result["benchmark"], result["map"], result["size"]))
+        if before is None: continue
+        checks = [("time", result["min"], before["min"])]
+        if result["peak"] is not None and before.get("peak"):
+            checks.append(("memory", result["peak"], before["peak"]))
+        for what, now, then in checks:
+            change = now / max(then, 1e-12) - 1
+            flag = "REGRESSION" if change > tolerance else ""
+            line = (f"{result['benchmark']:<16} {result['map']:<7} {result['size']:>8}"
+                    f"  {what:<6} {change * 100:+8.1f}%  {flag}")
+            print(line)
+            if flag: regressions.append(line)
+    return regressions
+
+def _parse_list(value: str) -> list[str]:
+    return [part.strip() for part in value.split(",") if part.strip()]
+
+def _parse_sizes(value: str) -> list[int]:
+    try:
+        sizes = [int(float(part)) for part in _parse_list(value)]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid sizes {value!r}")
+    if not sizes or min(sizes) < 2:
+        raise argparse.ArgumentTypeError(f"invalid sizes {value!r}")
+    return sizes
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python3 -m kmetromaker.bench",
+        description="Time KMetroMaker's hot paths on generated maps.")
+    parser.add_argument("--maps", type=_parse_list, default=list(mapKinds),
+                        help=f"map kinds to generate (default: {','.join(mapKinds)})")
+    parser.add_argument("--sizes", type=_parse_sizes, default=[100, 10000, 1000000],
+                        help="numbers of stations per map (default: 100,10000,1000000)")
+    parser.add_argument("--benchmarks", type=_parse_list, default=list(benchmarks),
+                        help=f"benchmarks to run (default: {','.join(benchmarks)})")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="times each benchmark is run, the fastest run is reported (default: 5)")
+    parser.add_argument("--budget", type=float, default=10,
+                        help="stop repeating a benchmark after this many seconds (default: 10)")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the generated maps")
+    parser.add_argument("--no-memory", dest="memory", action="store_false",
+                        help="skip measuring peak memory")
+    parser.add_argument("-o", "--output", default="bench.json", metavar="FILE",
+                        help="file to write the results to as JSON (default: bench.json)")
+    parser.add_argument("--compare", metavar="FILE",
+                        help="compare against results saved earlier and fail on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="slowdown counted as a regression when comparing (default: 0.1)")
+    arguments = parser.parse_args(argv)
+
+    for kind in arguments.maps:
+        if kind not in mapKinds: parser.error(f"unknown map kind {kind!r}")
+    for name in arguments.benchmarks:
+        if name not in benchmarks: parser.error(f"unknown benchmark {name!r}")
+    return arguments
+
+def main(argv: list[str]) -> int:
+    arguments = parse_args(argv)
+    baseline = None
+    if arguments.compare is not None:
+        try:
+            report = json.loads(Path(arguments.compare).read_text())
+            baseline = report["results"]
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            print(f"{arguments.compare}: not a benchmark result file ({error})", file=sys.stderr)
+            return 2
+        if report.get("version") != BENCH_VERSION:
+            print(f"{arguments.compare}: written by benchmark suite version {report.get('version')}, "
+                  f"this is version {BENCH_VERSION}; rerun the baseline", file=sys.stderr)
+            return 2
+
+    results = run(arguments.maps, arguments.sizes, arguments.benchmarks,
+                  max(1, arguments.repeat), arguments.budget, arguments.seed, arguments.memory)
+    write_results(arguments.output, results)
+    if pygame.get_init(): pygame.quit()
+    print(f"results written to {arguments.output}")
+    if baseline is None: return 0
+
+    regressions = compare(results, baseline, arguments.tolerance)
+    print(f"{len(regressions)} regression(s) against {arguments.compare}")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
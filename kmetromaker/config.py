@@ -0,0 +1,15 @@
+import tomllib
+from pathlib import Path
+
+basePath = Path(__file__).parent.parent.resolve()
+resourcesPath = basePath.joinpath("resources").resolve()
+
+try:
+    with open(str(basePath.joinpath("config.toml")), "rb") as configfile:
+        config = tomllib.load(configfile)
+except (FileNotFoundError, tomllib.TOMLDecodeError):
+    with open(str(resourcesPath.joinpath("default.toml")), "rb") as configfile:
+        config = tomllib.load(configfile)
+
+windowSize: tuple[int, int] = (config.get("windowWidth", 1200),
+                               config.get("windowHeight", 800))
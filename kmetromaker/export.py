@@ -0,0 +1,161 @@
+import pygame, math, typing, struct, zlib, multiprocessing
+import concurrent.futures
+import numpy as np
+from collections import deque
+from . import render
+from .config import config, windowSize
+from .fileformat import load_file, save_file
+from .model import _view
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+ADLER_BASE = 65521
+
+exportStripHeight: int = max(1, config.get("exportStripHeight", 256))
+exportCompression: int = config.get("exportCompression", 6)
+exportJobs: int = max(1, config.get("exportJobs", 2))
+exportMargin: int = 16
+
+def parse_size(size: str) -> tuple[int, int]:
+    width, height = (int(part) for part in size.lower().split("x"))
+    if width <= 0 or height <= 0:
+        raise ValueError(f"invalid size {size!r}")
+    return width, height
+
+def _adler32_combine(adler1: int, adler2: int, length2: int) -> int:
+    rem = length2 % ADLER_BASE
+    sum1 = adler1 & 0xFFFF
+    sum2 = rem * sum1 % ADLER_BASE
+    sum1 = (sum1 + (adler2 & 0xFFFF) + ADLER_BASE - 1) % ADLER_BASE
+    sum2 = (sum2 + (adler1 >> 16) + (adler2 >> 16) + ADLER_BASE - rem) % ADLER_BASE
+    return sum1 | (sum2 << 16)
+
+def _png_chunk(file: typing.BinaryIO, kind: bytes, data: bytes) -> None:
+    file.write(struct.pack(">I", len(data)))
+    file.write(kind)
+    file.write(data)
+    file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind))))
+
+def _set_view(zoom: float) -> None:
+    render.zoom = zoom
+    render.pan.set_pos(0, 0)
+    render.canvasSize = windowSize
+    render.canvasOrigin = (0, 0)
+
+def map_extent() -> pygame.Rect | None:
+    stations = render.stations
+    rivers = render.rivers
+    if not len(stations) and not len(rivers): return None
+    _set_view(1.0)
+    width, height = windowSize
+    rects: list[pygame.Rect] = []
+
+    if len(stations):
+        xs = np.floor(render._screen_axis(_view(stations.x), width, 0) * width).astype(np.int64)
+        ys = np.floor(render._screen_axis(_view(stations.y), height, 0) * height).astype(np.int64)
+        left, top, right, bottom = xs.min(), ys.min(), xs.max(), ys.max()
+        stroke = config.get("connectionStroke", 6)
+        radius = max(config.get("stationStroke", 2) + config.get("stationSize", 8),
+                     stroke * _view(render.connections.count).max(initial=1))
+        radius = math.ceil(radius) + 1
+        rects.append(pygame.Rect(int(left) - radius, int(top) - radius,
+                                 int(right - left) + radius * 2, int(bottom - top) + radius * 2))
+
+        reach = render.textdis + 24 * (stations.longest + 1)
+        edge = np.flatnonzero((xs < left + reach) | (xs > right - reach)
+                              | (ys < top + reach) | (ys > bottom - reach))
+        for station in edge.tolist():
+            rects.append(render._label_bounds(stations.names[station],
+                                              (int(xs[station]), int(ys[station])),
+                                              stations.dir(station)))
+
+    if len(rivers):
+        ends = np.concatenate((
+            np.stack((_view(rivers.x1), _view(rivers.y1)), axis=1),
+            np.stack((_view(rivers.x2), _view(rivers.y2)), axis=1)))
+        xs = np.floor(render._screen_axis(ends[:, 0], width, 0) * width)
+        ys = np.floor(render._screen_axis(ends[:, 1], height, 0) * height)
+        radius = math.ceil(config.get("riverStroke", 25) / 2) + 1
+        rects.append(pygame.Rect(int(xs.min()) - radius, int(ys.min()) - radius,
+                                 int(xs.max() - xs.min()) + radius * 2,
+                                 int(ys.max() - ys.min()) + radius * 2))
+
+    return rects[0].unionall(rects[1:])
+
+def fit_extent(extent: pygame.Rect, size: tuple[int, int]) -> tuple[float, tuple[int, int]]:
+    extent = extent.inflate(exportMargin * 2, exportMargin * 2)
+    zoom = min(size[0] / extent.width, size[1] / extent.height)
+    width, height = windowSize
+    return zoom, (math.floor((extent.centerx - width // 2) * zoom + width // 2 - size[0] / 2),
+                  math.floor((extent.centery - height // 2) * zoom + height // 2 - size[1] / 2))
+
+def render_strip(zoom: float, origin: tuple[int, int], width: int,
+                 top: int, height: int) -> tuple[bytes, int, int]:
+    _set_view(zoom)
+    strip, = render.draw_canvas((width, height), (origin[0], origin[1] + top))
+
+    raw = np.zeros((height, width * 3 + 1), np.uint8)
+    raw[:, 1:] = np.frombuffer(pygame.image.tobytes(strip, "RGB"),
+                               np.uint8).reshape(height, width * 3)
+    raw = raw.tobytes()
+    packer = zlib.compressobj(exportCompression, zlib.DEFLATED, -15)
+    return (packer.compress(raw) + packer.flush(zlib.Z_SYNC_FLUSH),
+            zlib.adler32(raw), len(raw))
+
+def _init_worker(source: str) -> None:
+    render.init_headless()
+    render.init(pygame.Surface((1, 1)))
+    render.set_model(load_file(source))
+
+def _render_strips(pool: concurrent.futures.Executor | None, jobs: int,
+                   strips: list[tuple]) -> typing.Iterator[tuple[bytes, int, int]]:
+    if pool is None:
+        for strip in strips:
+            yield render_strip(*strip)
+        return
+
+    pending: deque[concurrent.futures.Future] = deque()
+    for strip in strips:
+        pending.append(pool.submit(render_strip, *strip))
+        if len(pending) > jobs * 2:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def write_png(file: typing.BinaryIO, size: tuple[int, int],
+              strips: typing.Iterable[tuple[bytes, int, int]],
+              count: int) -> typing.Iterator[float]:
+    file.write(PNG_SIGNATURE)
+    _png_chunk(file, b"IHDR", struct.pack(">IIBBBBB", *size, 8, 2, 0, 0, 0))
+
+    adler = 1
+    header = b"\x78\x9c"
+    for done, (data, checksum, length) in enumerate(strips, 1):
+        adler = _adler32_combine(adler, checksum, length)
+        _png_chunk(file, b"IDAT", header + data)
+        header = b""
+        yield done / count
+
+    _png_chunk(file, b"IDAT", header + b"\x03\x00" + struct.pack(">I", adler))
+    _png_chunk(file, b"IEND", b"")
+
+def export_png(filename: str, size: tuple[int, int],
+               progress: typing.Callable[[float], None] | None = None,
+               source: str | None = None, jobs: int = 1) -> None:
+    pool = None
+    if source is not None:
+        pool = concurrent.futures.ProcessPoolExecutor(
+            max(1, jobs), mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker, initargs=(source,))
+
+    try:
+        extent = map_extent() if pool is None else pool.submit(map_extent).result()
+        if extent is None: raise ValueError("the map is empty")
+        zoom, origin = fit_extent(extent, size)
+
+        strips = [(zoom, origin, size[0], top, min(exportStripHeight, size[1] - top))
+                  for top in range(0, size[1], exportStripHeight)]
+        save_file(filename, None, progress=progress,
+                  writer=lambda file, _: write_png(
+                      file, size, _render_strips(pool, max(1, jobs), strips), len(strips)))
+    finally:
+        if pool is not None: pool.shutdown(cancel_futures=True)
@@ -0,0 +1,470 @@
+import math, typing, sys, struct, mmap, re, os, tempfile
+import numpy as np
+from array import array
+from pathlib import Path
+from .config import config, windowSize
+from .model import TextDirection, StationStore, ConnectionStore, RiverStore, _view
+
+KMM3_HEADER = struct.Struct("<6sIIIII")
+KMM4_HEADER = struct.Struct("<6sIIIIIII")
+
+saveChunkSize: int = max(1, config.get("saveChunkSize", 65536))
+saveBufferSize: int = 1024 * 1024
+
+def _pixel(x: float, y: float, size: tuple[int, int]) -> tuple[int, int]:
+    return math.floor(x * size[0]), math.floor(y * size[1])
+
+def _columns_write(file: typing.BinaryIO, count: int,
+                   *columns: array) -> typing.Iterator[int]:
+    for column in columns:
+        for start in range(0, count, saveChunkSize):
+            chunk = column[start:start + saveChunkSize]
+            if sys.byteorder != "little": chunk.byteswap()
+            file.write(chunk)
+            yield len(chunk)
+
+def _columns_load(data: memoryview, offset: int, count: int, *columns: array) -> int:
+    for column in columns:
+        end = offset + count * column.itemsize
+        if end > len(data): raise ValueError("truncated KMM file")
+        column.frombytes(data[offset:end])
+        if sys.byteorder != "little": column.byteswap()
+        offset = end
+    return offset
+
+def save_file_v3(file: typing.BinaryIO,
+                 model: tuple[StationStore, ConnectionStore, RiverStore]) -> typing.Iterator[float]:
+    stations, connections, rivers = model
+    stations.names.materialize()
+    total = max(1, 4 * len(stations) + 3 * len(connections) + 5 * len(rivers))
+    done = 0
+
+    offsets = array("I", [0])
+    file.seek(KMM3_HEADER.size + (len(stations) + 1) * offsets.itemsize)
+    for start in range(0, len(stations), saveChunkSize):
+        chunk = [name.encode("utf-8")
+                 for name in stations.names.names[start:start + saveChunkSize]]
+        for name in chunk:
+            offsets.append(offsets[-1] + len(name))
+        file.write(b"".join(chunk))
+        done += len(chunk)
+        yield done / total
+
+    for written in _columns_write(file, len(stations),
+                                  stations.x, stations.y, stations.dirs):
+        done += written
+        yield done / total
+    for written in _columns_write(file, len(connections),
+                                  connections.a, connections.b, connections.colors):
+        done += written
+        yield done / total
+    for written in _columns_write(file, len(rivers),
+                                  rivers.x1, rivers.y1, rivers.x2, rivers.y2, rivers.colors):
+        done += written
+        yield done / total
+    file.write(b"\xfeThank you for using KMetroMaker.\x04\x05")
+
+    file.seek(0)
+    file.write(KMM3_HEADER.pack(b"KMM.3\xfe", 0, len(stations),
+                                len(connections), len(rivers), offsets[-1]))
+    for _ in _columns_write(file, len(offsets), offsets): pass
+    yield 1.0
+
+def save_file_v4(file: typing.BinaryIO,
+                 model: tuple[StationStore, ConnectionStore, RiverStore]) -> typing.Iterator[float]:
+    stations, connections, rivers = model
+    stations.names.materialize()
+    lines = connections.lines.live()
+    chunks = [connections.lines.raw(line) for line in lines]
+    stops = array("i")
+    stops.frombytes(b"".join(chunks))
+    stopOffsets = array("I", [0])
+    stopOffsets.frombytes(np.cumsum([len(chunk) for chunk in chunks], dtype=np.uint32).tobytes())
+    colors = array("I", _view(connections.lines.colors)[lines].tobytes())
+    lineNames = [connections.lines.names[line].encode("utf-8") for line in lines]
+    lineOffsets = array("I", [0])
+    lineOffsets.frombytes(np.cumsum([len(name) for name in lineNames], dtype=np.uint32).tobytes())
+    total = max(1, 4 * len(stations) + len(stops) + 5 * len(rivers))
+    done = 0
+
+    offsets = array("I", [0])
+    file.seek(KMM4_HEADER.size + (len(stations) + 1) * offsets.itemsize)
+    for start in range(0, len(stations), saveChunkSize):
+        chunk = [name.encode("utf-8")
+                 for name in stations.names.names[start:start + saveChunkSize]]
+        for name in chunk:
+            offsets.append(offsets[-1] + len(name))
+        file.write(b"".join(chunk))
+        done += len(chunk)
+        yield done / total
+
+    for written in _columns_write(file, len(stations),
+                                  stations.x, stations.y, stations.dirs):
+        done += written
+        yield done / total
+    for _ in _columns_write(file, len(stopOffsets), stopOffsets, lineOffsets): pass
+    for _ in _columns_write(file, len(colors), colors): pass
+    file.write(b"".join(lineNames))
+    for written in _columns_write(file, len(stops), stops):
+        done += written
+        yield done / total
+    for written in _columns_write(file, len(rivers),
+                                  rivers.x1, rivers.y1, rivers.x2, rivers.y2, rivers.colors):
+        done += written
+        yield done / total
+    file.write(b"\xfeThank you for using KMetroMaker.\x04\x05")
+
+    file.seek(0)
+    file.write(KMM4_HEADER.pack(b"KMM.4\xfe", 0, len(stations), len(lines), len(stops),
+                                len(rivers), offsets[-1], lineOffsets[-1]))
+    for _ in _columns_write(file, len(offsets), offsets): pass
+    yield 1.0
+
+def save_file(filename: str, model: tuple[StationStore, ConnectionStore, RiverStore],
+              writer: typing.Callable[..., typing.Iterator[float]] = save_file_v4,
+              progress: typing.Callable[[float], None] | None = None) -> None:
+    target = Path(filename)
+    fd, temp = tempfile.mkstemp(prefix=f".{target.name}.", suffix=".tmp",
+                                dir=target.parent)
+    try:
+        with os.fdopen(fd, "wb", buffering=saveBufferSize) as file:
+            for done in writer(file, model):
+                if progress is not None: progress(done)
+            file.flush()
+            os.fsync(file.fileno())
+        os.chmod(temp, _file_mode(target))
+        os.replace(temp, target)
+    except:
+        Path(temp).unlink(missing_ok=True)
+        raise
+
+def _file_mode(target: Path) -> int:
+    try:
+        return target.stat().st_mode & 0o7777
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+def save_file_v2(file: typing.BinaryIO,
+                 model: tuple[StationStore, ConnectionStore, RiverStore],
+                 size: tuple[int, int] = windowSize) -> typing.Iterator[float]:
+    stations, connections, rivers = model
+    stations.names.materialize()
+    total = max(1, len(stations) + len(connections) + len(rivers))
+    done = 0
+
+    file.write(b"KMM.2\xfe")
+    for start in range(0, len(stations), saveChunkSize):
+        append: list[bytes] = []
+        for station in range(start, min(start + saveChunkSize, len(stations))):
+            where = _pixel(*stations.pos(station), size)
+            append.append(bytes(stations.names[station], "utf-8"))
+            append.append(b"\x00")
+            append.append(
+                bytes(str(where[0]),
+                      "utf-8"))
+            append.append(b"\x01")
+            append.append(
+                bytes(str(where[1]),
+                      "utf-8"))
+            append.append(b"\x02")
+            append.append(
+                bytes(str(stations.dirs[station]),
+                      "utf-8"))
+            append.append(b"\x03")
+        file.write(b"".join(append))
+        done += len(append) // 7
+        yield done / total
+    file.write(b"\xff")
+    for start in range(0, len(connections), saveChunkSize):
+        append = []
+        for connection in range(start, min(start + saveChunkSize, len(connections))):
+            t1 = _pixel(*stations.pos(connections.a[connection]), size)
+            t2 = _pixel(*stations.pos(connections.b[connection]), size)
+            append.append(
+                bytes(str(t1[0]),
+                      "utf-8"))
+            append.append(b"\x00")
+            append.append(
+                bytes(str(t1[1]),
+                      "utf-8"))
+            append.append(b"\x01")
+            append.append(
+                bytes(str(t2[0]),
+                      "utf-8"))
+            append.append(b"\x02")
+            append.append(
+                bytes(str(t2[1]),
+                      "utf-8"))
+            append.append(b"\x03")
+            append.append(
+                bytes(str(connections.colors[connection]),
+                      "utf-8"))
+            append.append(b"\x04")
+        file.write(b"".join(append))
+        done += len(append) // 10
+        yield done / total
+    file.write(b"\xff")
+    for start in range(0, len(rivers), saveChunkSize):
+        append = []
+        for river in range(start, min(start + saveChunkSize, len(rivers))):
+            t1 = _pixel(rivers.x1[river], rivers.y1[river], size)
+            t2 = _pixel(rivers.x2[river], rivers.y2[river], size)
+            append.append(
+                bytes(str(t1[0]),
+                      "utf-8"))
+            append.append(b"\x00")
+            append.append(
+                bytes(str(t1[1]),
+                      "utf-8"))
+            append.append(b"\x01")
+            append.append(
+                bytes(str(t2[0]),
+                      "utf-8"))
+            append.append(b"\x02")
+            append.append(
+                bytes(str(t2[1]),
+                      "utf-8"))
+            append.append(b"\x03")
+            append.append(
+                bytes(str(rivers.colors[river]),
+                      "utf-8"))
+            append.append(b"\x04")
+        file.write(b"".join(append))
+        done += len(append) // 10
+        yield done / total
+    file.write(b"\xfeThank you for using KMetroMaker.\x04\x05")
+    yield 1.0
+
+def open_file_v1(data: bytes,
+                 size: tuple[int, int] = windowSize) -> tuple[StationStore, ConnectionStore, RiverStore]:
+    stations = StationStore()
+    connections = ConnectionStore(stations)
+    rivers = RiverStore()
+    byPixel: dict[tuple[int, int], int] = {}
+    ends: tuple[array, array, array] = (array("i"), array("i"), array("I"))
+
+    parts = re.split(rb"[\xfe\xff]", data)
+    
+    parts.extend([[], []])
+
+    stationParts = parts[1].split(b"\x03")
+    connectionParts = parts[2].split(b"\x04")
+
+    for stationPart in stationParts:
+        if not stationPart: continue
+        subParts = stationPart.split(b"\x00")
+        name = subParts[0]
+        subParts = subParts[1].split(b"\x01")
+        x = int(subParts[0])
+        subParts = subParts[1].split(b"\x02")
+        y = int(subParts[0])
+        dir = TextDirection(int(subParts[1]))
+        byPixel.setdefault((x, y), stations.add(x / size[0], y / size[1], name.decode(), dir))
+    for connectionPart in connectionParts:
+        if not connectionPart: continue
+        subParts = connectionPart.split(b"\x00")
+        x1 = int(subParts[0])
+        subParts = subParts[1].split(b"\x01")
+        y1 = int(subParts[0])
+        subParts = subParts[1].split(b"\x02")
+        x2 = int(subParts[0])
+        subParts = subParts[1].split(b"\x03")
+        y2 = int(subParts[0])
+        color = int(subParts[1])
+        t1 = byPixel.get((x1, y1), -1)
+        t2 = byPixel.get((x2, y2), -1)
+        if t1 < 0 or t2 < 0 or t1 == t2: continue
+        ends[0].append(t1)
+        ends[1].append(t2)
+        ends[2].append(color)
+    connections.extend(*map(_view, ends))
+
+    return stations, connections, rivers
+
+def open_file_v2(data: bytes,
+                 size: tuple[int, int] = windowSize) -> tuple[StationStore, ConnectionStore, RiverStore]:
+    stations = StationStore()
+    connections = ConnectionStore(stations)
+    rivers = RiverStore()
+    byPixel: dict[tuple[int, int], int] = {}
+    ends: tuple[array, array, array] = (array("i"), array("i"), array("I"))
+
+    parts = re.split(rb"[\xfe\xff]", data)
+    
+    parts.extend([[], []])
+
+    stationParts = parts[1].split(b"\x03")
+    connectionParts = parts[2].split(b"\x04")
+    riverParts = parts[3].split(b"\x04")
+
+    for stationPart in stationParts:
+        if not stationPart: continue
+        subParts = stationPart.split(b"\x00")
+        name = subParts[0]
+        subParts = subParts[1].split(b"\x01")
+        x = int(subParts[0])
+        subParts = subParts[1].split(b"\x02")
+        y = int(subParts[0])
+        dir = TextDirection(int(subParts[1]))
+        byPixel.setdefault((x, y), stations.add(x / size[0], y / size[1], name.decode(), dir))
+    for connectionPart in connectionParts:
+        if not connectionPart: continue
+        subParts = connectionPart.split(b"\x00")
+        x1 = int(subParts[0])
+        subParts = subParts[1].split(b"\x01")
+        y1 = int(subParts[0])
+        subParts = subParts[1].split(b"\x02")
+        x2 = int(subParts[0])
+        subParts = subParts[1].split(b"\x03")
+        y2 = int(subParts[0])
+        color = int(subParts[1])
+        t1 = byPixel.get((x1, y1), -1)
+        t2 = byPixel.get((x2, y2), -1)
+        if t1 < 0 or t2 < 0 or t1 == t2: continue
+        ends[0].append(t1)
+        ends[1].append(t2)
+        ends[2].append(color)
+    for riverPart in riverParts:
+        if not riverPart: continue
+        subParts = riverPart.split(b"\x00")
+        x1 = int(subParts[0])
+        subParts = subParts[1].split(b"\x01")
+        y1 = int(subParts[0])
+        subParts = subParts[1].split(b"\x02")
+        x2 = int(subParts[0])
+        subParts = subParts[1].split(b"\x03")
+        y2 = int(subParts[0])
+        color = int(subParts[1])
+        t1 = (x1 / size[0], y1 / size[1])
+        t2 = (x2 / size[0], y2 / size[1])
+        if t1 == t2: continue
+        rivers.add(*t1, *t2, color)
+    connections.extend(*map(_view, ends))
+
+    return stations, connections, rivers
+
+def open_file_v3(data: bytes | mmap.mmap) -> tuple[StationStore, ConnectionStore, RiverStore]:
+    stations = StationStore()
+    connections = ConnectionStore(stations)
+    rivers = RiverStore()
+
+    source = data if isinstance(data, mmap.mmap) else None
+    view = memoryview(data)
+    names: memoryview | None = None
+
+    try:
+        _, _, stationCount, connectionCount, riverCount, nameBytes = \
+            KMM3_HEADER.unpack_from(view)
+
+        offsets = array("I")
+        offset = _columns_load(view, KMM3_HEADER.size, stationCount + 1, offsets)
+        if offsets[0] != 0 or offsets[-1] != nameBytes or offset + nameBytes > len(view) \
+                or (np.diff(_view(offsets)) < 0).any():
+            raise ValueError("corrupt KMM.3 string table")
+        names = view[offset:offset + nameBytes]
+        offset += nameBytes
+
+        offset = _columns_load(view, offset, stationCount,
+                               stations.x, stations.y, stations.dirs)
+        offset = _columns_load(view, offset, connectionCount,
+                               connections.a, connections.b, connections.colors)
+        offset = _columns_load(view, offset, riverCount,
+                               rivers.x1, rivers.y1, rivers.x2, rivers.y2, rivers.colors)
+
+        ends = np.concatenate((_view(connections.a), _view(connections.b)))
+        if ends.size and (ends.min() < 0 or ends.max() >= stationCount):
+            raise ValueError("KMM.3 connection refers to a missing station")
+        del ends
+    except:
+        if names is not None: names.release()
+        raise
+    finally:
+        view.release()
+
+    stations.names.attach(names, offsets, source)
+    stations.reindex()
+    connections.migrate()
+    rivers.reindex()
+    return stations, connections, rivers
+
+def open_file_v4(data: bytes | mmap.mmap) -> tuple[StationStore, ConnectionStore, RiverStore]:
+    stations = StationStore()
+    connections = ConnectionStore(stations)
+    rivers = RiverStore()
+
+    source = data if isinstance(data, mmap.mmap) else None
+    view = memoryview(data)
+    names: memoryview | None = None
+
+    try:
+        _, _, stationCount, lineCount, stopCount, riverCount, nameBytes, lineNameBytes = \
+            KMM4_HEADER.unpack_from(view)
+
+        offsets = array("I")
+        offset = _columns_load(view, KMM4_HEADER.size, stationCount + 1, offsets)
+        if offsets[0] != 0 or offsets[-1] != nameBytes or offset + nameBytes > len(view) \
+                or (np.diff(_view(offsets)) < 0).any():
+            raise ValueError("corrupt KMM.4 string table")
+        names = view[offset:offset + nameBytes]
+        offset += nameBytes
+
+        offset = _columns_load(view, offset, stationCount,
+                               stations.x, stations.y, stations.dirs)
+
+        stopOffsets, lineOffsets, colors, stops = array("I"), array("I"), array("I"), array("i")
+        offset = _columns_load(view, offset, lineCount + 1, stopOffsets, lineOffsets)
+        offset = _columns_load(view, offset, lineCount, colors)
+        if lineOffsets[0] != 0 or lineOffsets[-1] != lineNameBytes \
+                or offset + lineNameBytes > len(view) or (np.diff(_view(lineOffsets)) < 0).any():
+            raise ValueError("corrupt KMM.4 line names")
+        lineNames = [bytes(view[start:end]).decode("utf-8") for start, end in
+                     zip((offset + _view(lineOffsets[:-1])).tolist(),
+                         (offset + _view(lineOffsets[1:])).tolist())]
+        offset += lineNameBytes
+        offset = _columns_load(view, offset, stopCount, stops)
+        if stopOffsets[0] != 0 or stopOffsets[-1] != stopCount \
+                or (np.diff(_view(stopOffsets)) < 2).any():
+            raise ValueError("corrupt KMM.4 line table")
+        if stops and (_view(stops).min() < 0 or _view(stops).max() >= stationCount):
+            raise ValueError("KMM.4 line refers to a missing station")
+
+        offset = _columns_load(view, offset, riverCount,
+                               rivers.x1, rivers.y1, rivers.x2, rivers.y2, rivers.colors)
+    except:
+        if names is not None: names.release()
+        raise
+    finally:
+        view.release()
+
+    stations.names.attach(names, offsets, source)
+    stations.reindex()
+    connections.load((_view(stopOffsets), _view(stops), _view(colors), lineNames))
+    rivers.reindex()
+    return stations, connections, rivers
+
+def load_file(filename: str,
+              size: tuple[int, int] = windowSize) -> tuple[StationStore, ConnectionStore, RiverStore] | None:
+    with open(filename, "rb") as file:
+        try:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            data = b""
+
+    try:
+        if data[:6] == b"KMM.1\xfe":
+            return open_file_v1(data, size)
+        if data[:6] == b"KMM.2\xfe":
+            return open_file_v2(data, size)
+        if data[:6] == b"KMM.3\xfe":
+            model = open_file_v3(data)
+            data = None
+            return model
+        if data[:6] == b"KMM.4\xfe":
+            model = open_file_v4(data)
+            data = None
+            return model
+        return None
+    finally:
+        if isinstance(data, mmap.mmap): data.close()
@@ -0,0 +1,42 @@
+import typing, contextlib
+from collections import deque
+
+Edit = tuple[typing.Any, ...]
+
+class History:
+    def __init__(self: typing.Self, depth: int) -> None:
+        self.done: deque[tuple[Edit, ...]] = deque(maxlen=max(0, depth))
+        self.undone: deque[tuple[Edit, ...]] = deque(maxlen=max(0, depth))
+        self.replaying: bool = False
+
+    def __len__(self: typing.Self) -> int:
+        return len(self.done)
+
+    def push(self: typing.Self, *edits: Edit) -> None:
+        if self.replaying or not edits: return
+        self.done.append(edits)
+        self.undone.clear()
+
+    def undo(self: typing.Self) -> tuple[Edit, ...] | None:
+        if not self.done: return None
+        edits = self.done.pop()
+        self.undone.append(edits)
+        return edits
+
+    def redo(self: typing.Self) -> tuple[Edit, ...] | None:
+        if not self.undone: return None
+        edits = self.undone.pop()
+        self.done.append(edits)
+        return edits
+
+    def clear(self: typing.Self) -> None:
+        self.done.clear()
+        self.undone.clear()
+
+    @contextlib.contextmanager
+    def replay(self: typing.Self) -> typing.Iterator[None]:
+        self.replaying = True
+        try:
+            yield
+        finally:
+            self.replaying = False
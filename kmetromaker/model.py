@@ -0,0 +1,963 @@
+import pygame, math, typing, sys, mmap
+import numpy as np
+from array import array
+from enum import Flag, auto
+from .config import config
+
+grid: int = config.get("gridSpace", 20)
+root: pygame.Surface | None = None
+
+class Coordinate:
+    def __init__(self: typing.Self, x: float = 0, y: float = 0) -> None:
+        self.x = x
+        self.y = y
+    
+    def set_root(self: typing.Self, root: pygame.Surface) -> None:
+        self.root = root
+
+    def set_pos(self: typing.Self, x: float, y: float) -> None:
+        self.x = x
+        self.y = y
+        
+    def set_pos_whole(self: typing.Self, x: int, y: int) -> None:
+        self.x = x / self.root.get_width()
+        self.y = y / self.root.get_height()
+
+    def set_pos_whole_cartesian(self: typing.Self, x: int, y: int) -> None:
+        self.set_pos_whole(
+            x + self.root.get_width() // 2,
+            y + self.root.get_height() // 2)
+
+    def set_pos_grid(self: typing.Self, gridSize: int) -> None:
+        x, y = self.get_pos()
+        x = math.floor((x * gridSize) + 0.5) / gridSize
+        y = math.floor((y * gridSize) + 0.5) / gridSize
+        self.set_pos(x, y)
+    
+    def get_root(self: typing.Self) -> pygame.Surface:
+        return self.root
+    
+    def get_pos(self: typing.Self) -> tuple[float, float]:
+        return self.x, self.y
+    
+    def get_pos_whole(self: typing.Self) -> tuple[int, int]:
+        return (math.floor(self.x * self.root.get_width()),
+                math.floor(self.y * self.root.get_height()))
+    
+    def get_pos_cartesian(self: typing.Self) -> tuple[float, float]:
+        return (self.x - 0.5, self.y - 0.5)
+    
+    def get_pos_whole_cartesian(self: typing.Self) -> tuple[int, int]:
+        return (math.floor(self.x * self.root.get_width()) - self.root.get_width() // 2,
+                math.floor(self.y * self.root.get_height()) - self.root.get_height() // 2)
+    
+    def copy(self: typing.Self, mul: int | float = 1, inCartesian: bool = False) -> "Coordinate":
+        if inCartesian:
+            c = Coordinate()
+            c.set_root(self.root)
+            c.set_pos((self.x - 0.5) * mul + 0.5,
+                      (self.y - 0.5) * mul + 0.5)
+            return c
+        c = Coordinate(self.x * mul, self.y * mul)
+        c.set_root(self.root)
+        return c
+
+    def __str__(self: typing.Self) -> str:
+        if self.root:
+            pos = self.get_pos_whole()
+            return f"({pos[0]}, {pos[1]})"
+        return f"({self.x}, {self.y})"
+
+    def __add__(self: typing.Self, other: "Coordinate") -> "Coordinate":
+        c = Coordinate(self.x + other.x, self.y + other.y)
+        if self.root: c.set_root(self.root)
+        elif other.root: c.set_root(other.root)
+        return c
+    
+    def __sub__(self: typing.Self, other: "Coordinate") -> "Coordinate":
+        c = Coordinate(self.x - other.x, self.y - other.y)
+        if self.root: c.set_root(self.root)
+        elif other.root: c.set_root(other.root)
+        return c
+
+    def __mul__(self: typing.Self, other: "Coordinate") -> "Coordinate":
+        c = Coordinate(self.x * other.x, self.y * other.y)
+        if self.root: c.set_root(self.root)
+        elif other.root: c.set_root(other.root)
+        return c
+
+    def __eq__(self: typing.Self, other: "Coordinate") -> bool:
+        return self.get_pos() == other.get_pos()
+
+class TextDirection(Flag):
+    LEFT = auto()
+    RIGHT = auto()
+    UP = auto()
+    DOWN = auto()
+
+class SpatialGrid:
+    maxCells: int = 64
+
+    def __init__(self: typing.Self, cellSize: float) -> None:
+        self.cellSize = cellSize
+        self.cells: dict[int, list[int]] = {}
+        self.large: list[int] = []
+        self.size: int = 0
+        self.stale: int = 0
+
+    def clear(self: typing.Self) -> None:
+        self.cells.clear()
+        self.large.clear()
+        self.size = 0
+        self.stale = 0
+
+    def shrink(self: typing.Self, size: int) -> None:
+        self.stale += self.size - size
+        self.size = size
+
+    def replace(self: typing.Self, idx: int, x1: float, y1: float,
+                x2: float | None = None, y2: float | None = None) -> None:
+        self.stale += 1
+        self.insert(idx, x1, y1, x2, y2)
+
+    def _span(self: typing.Self, x1: float, y1: float,
+              x2: float, y2: float) -> tuple[int, int, int, int]:
+        return (math.floor(min(x1, x2) / self.cellSize),
+                math.floor(min(y1, y2) / self.cellSize),
+                math.floor(max(x1, x2) / self.cellSize),
+                math.floor(max(y1, y2) / self.cellSize))
+
+    def insert(self: typing.Self, idx: int, x1: float, y1: float,
+               x2: float | None = None, y2: float | None = None) -> None:
+        if x2 is None: x2, y2 = x1, y1
+        cx1, cy1, cx2, cy2 = self._span(x1, y1, x2, y2)
+        self.size = max(self.size, idx + 1)
+
+        if (cx2 - cx1 + 1) * (cy2 - cy1 + 1) > self.maxCells:
+            self.large.append(idx)
+            return
+        for cx in range(cx1, cx2 + 1):
+            for cy in range(cy1, cy2 + 1):
+                self.cells.setdefault((cx << 32) + cy, []).append(idx)
+
+    def rebuild(self: typing.Self, x1: np.ndarray, y1: np.ndarray,
+                x2: np.ndarray | None = None, y2: np.ndarray | None = None) -> None:
+        if x2 is None: x2, y2 = x1, y1
+        self.clear()
+        self.size = len(x1)
+
+        cx1 = np.floor(np.minimum(x1, x2) / self.cellSize).astype(np.int64)
+        cy1 = np.floor(np.minimum(y1, y2) / self.cellSize).astype(np.int64)
+        w = np.floor(np.maximum(x1, x2) / self.cellSize).astype(np.int64) - cx1 + 1
+        h = np.floor(np.maximum(y1, y2) / self.cellSize).astype(np.int64) - cy1 + 1
+        spans = w * h
+
+        large = spans > self.maxCells
+        self.large = np.flatnonzero(large).tolist()
+        ids = np.flatnonzero(~large)
+        spans = spans[ids]
+        cellIds = np.repeat(ids, spans)
+        k = np.arange(len(cellIds)) - np.repeat(np.cumsum(spans) - spans, spans)
+        width = np.repeat(w[ids], spans)
+        keys = ((np.repeat(cx1[ids], spans) + k % width) << 32) \
+            + np.repeat(cy1[ids], spans) + k // width
+
+        order, uniq, starts, _ = _group(keys)
+        self.cells = dict(zip(uniq.tolist(), _split(cellIds[order], starts)))
+        self.stale = 0
+
+    def query(self: typing.Self, x1: float, y1: float,
+              x2: float, y2: float) -> np.ndarray:
+        cx1, cy1, cx2, cy2 = self._span(x1, y1, x2, y2)
+        if (cx2 - cx1 + 1) * (cy2 - cy1 + 1) >= len(self.cells):
+            return np.arange(self.size)
+
+        found: list[int] = list(self.large)
+        for cx in range(cx1, cx2 + 1):
+            for cy in range(cy1, cy2 + 1):
+                found.extend(self.cells.get((cx << 32) + cy, ()))
+        found = np.unique(np.array(found, dtype=np.int64))
+        return found[found < self.size] if self.stale else found
+
+class NameTable:
+    def __init__(self: typing.Self) -> None:
+        self.names: list[str | int] = []
+        self.source: mmap.mmap | None = None
+        self.blob: memoryview | None = None
+        self.offsets: array = array("I")
+
+    def __len__(self: typing.Self) -> int:
+        return len(self.names)
+
+    def __getitem__(self: typing.Self, idx: int) -> str:
+        name = self.names[idx]
+        if isinstance(name, int):
+            name = self.names[idx] = sys.intern(
+                str(self.blob[self.offsets[name]:self.offsets[name + 1]], "utf-8", "replace"))
+        return name
+
+    def __setitem__(self: typing.Self, idx: int, name: str) -> None:
+        self.names[idx] = sys.intern(name)
+
+    def __delitem__(self: typing.Self, idx: int) -> None:
+        del self.names[idx]
+
+    def swap(self: typing.Self, i: int, j: int) -> None:
+        self.names[i], self.names[j] = self.names[j], self.names[i]
+
+    def __iter__(self: typing.Self) -> typing.Iterator[str]:
+        return (self[idx] for idx in range(len(self.names)))
+
+    def append(self: typing.Self, name: str) -> None:
+        self.names.append(sys.intern(name))
+
+    def attach(self: typing.Self, blob: memoryview, offsets: array,
+               source: mmap.mmap | None = None) -> None:
+        self.clear()
+        self.blob = blob
+        self.offsets = offsets
+        self.source = source
+        self.names = list(range(len(offsets) - 1))
+
+    def longest(self: typing.Self) -> int:
+        lengths = [len(name) for name in self.names if isinstance(name, str)]
+        if self.blob is not None and len(self.offsets) > 1:
+            lengths.append(int(np.diff(_view(self.offsets)).max()))
+        return max(lengths, default=0)
+
+    def materialize(self: typing.Self) -> None:
+        if self.blob is None: return
+        for idx in range(len(self.names)):
+            self[idx]
+        self._release()
+
+    def clear(self: typing.Self) -> None:
+        self.names = []
+        self._release()
+
+    def _release(self: typing.Self) -> None:
+        if self.blob is not None:
+            self.blob.release()
+            self.blob = None
+        if self.source is not None:
+            self.source.close()
+            self.source = None
+        self.offsets = array("I")
+
+class StationStore:
+    def __init__(self: typing.Self) -> None:
+        self.x: array = array("d")
+        self.y: array = array("d")
+        self.dirs: array = array("B")
+        self.names: NameTable = NameTable()
+        self.longest: int = 0
+        self.index: dict[int, int] = {}
+        self.grid: SpatialGrid = SpatialGrid(1 / config.get("cullGridSize", 8))
+
+    def __len__(self: typing.Self) -> int:
+        return len(self.x)
+
+    def clear(self: typing.Self) -> None:
+        del self.x[:], self.y[:], self.dirs[:]
+        self.names.clear()
+        self.longest = 0
+        self.index.clear()
+        self.grid.clear()
+
+    def add(self: typing.Self, x: float, y: float, name: str,
+            dir: TextDirection = TextDirection.RIGHT) -> int:
+        idx = len(self.x)
+        self.x.append(x)
+        self.y.append(y)
+        self.dirs.append(dir.value)
+        self.names.append(name)
+        self.longest = max(self.longest, len(name))
+        self.index.setdefault(_grid_key(x, y), idx)
+        self.grid.insert(idx, x, y)
+        return idx
+
+    def _reindex_at(self: typing.Self, x: float, y: float) -> None:
+        key = _grid_key(x, y)
+        same = [other for other in self.grid.query(x, y, x, y).tolist()
+                if _grid_key(self.x[other], self.y[other]) == key]
+        if same: self.index[key] = min(same)
+        else: self.index.pop(key, None)
+
+    def swap(self: typing.Self, i: int, j: int) -> None:
+        if i == j: return
+        self.x[i], self.x[j] = self.x[j], self.x[i]
+        self.y[i], self.y[j] = self.y[j], self.y[i]
+        self.dirs[i], self.dirs[j] = self.dirs[j], self.dirs[i]
+        self.names.swap(i, j)
+        for idx in (i, j):
+            self.grid.replace(idx, self.x[idx], self.y[idx])
+        for idx in (i, j):
+            self._reindex_at(self.x[idx], self.y[idx])
+
+    def remove(self: typing.Self, idx: int) -> int:
+        last = len(self.x) - 1
+        self.swap(idx, last)
+        x, y = self.x[last], self.y[last]
+        del self.x[last], self.y[last], self.dirs[last], self.names[last]
+
+        self.grid.shrink(last)
+        self._reindex_at(x, y)
+        if self.grid.stale > len(self.x):
+            self.grid.rebuild(_view(self.x), _view(self.y))
+        return last
+
+    def restore(self: typing.Self, idx: int, x: float, y: float, name: str,
+                dir: TextDirection = TextDirection.RIGHT) -> None:
+        self.swap(idx, self.add(x, y, name, dir))
+
+    def inside(self: typing.Self, x1: float, y1: float, x2: float, y2: float) -> np.ndarray:
+        x1, x2 = min(x1, x2), max(x1, x2)
+        y1, y2 = min(y1, y2), max(y1, y2)
+        found = self.grid.query(x1, y1, x2, y2)
+        xs = _view(self.x)[found]
+        ys = _view(self.y)[found]
+        return found[(xs >= x1) & (xs <= x2) & (ys >= y1) & (ys <= y2)]
+
+    def reindex(self: typing.Self) -> None:
+        xs = _view(self.x)
+        ys = _view(self.y)
+        keys = (np.floor(xs * grid + 0.5).astype(np.int64) << 32) \
+            + np.floor(ys * grid + 0.5).astype(np.int64)
+        self.index = dict(zip(keys[::-1].tolist(), range(len(keys) - 1, -1, -1)))
+        self.longest = self.names.longest()
+        self.grid.rebuild(xs, ys)
+
+    def find(self: typing.Self, x: float, y: float) -> int:
+        idx = self.index.get(_grid_key(x, y), -1)
+        if idx < 0 or self.x[idx] != x or self.y[idx] != y:
+            return -1
+        return idx
+
+    def rename(self: typing.Self, idx: int, name: str) -> None:
+        self.names[idx] = name
+        self.longest = max(self.longest, len(name))
+
+    def pos(self: typing.Self, idx: int) -> tuple[float, float]:
+        return self.x[idx], self.y[idx]
+
+    def where(self: typing.Self, idx: int) -> "Coordinate":
+        return _coord(self.x[idx], self.y[idx])
+
+    def dir(self: typing.Self, idx: int) -> TextDirection:
+        return TextDirection(self.dirs[idx])
+
+LineState = tuple[tuple[int, ...], int, str]
+LineSnapshot = tuple[np.ndarray, np.ndarray, np.ndarray, list[str]]
+
+class LineStore:
+    def __init__(self: typing.Self) -> None:
+        self.stops: list[array | int | None] = []
+        self.colors: array = array("I")
+        self.names: list[str] = []
+        self.flat: array = array("i")
+        self.offsets: array = array("I")
+
+    def __len__(self: typing.Self) -> int:
+        return len(self.stops)
+
+    def __getitem__(self: typing.Self, line: int) -> array | None:
+        stops = self.stops[line]
+        if isinstance(stops, int):
+            stops = self.stops[line] = self.flat[self.offsets[stops]:self.offsets[stops + 1]]
+        return stops
+
+    def raw(self: typing.Self, line: int) -> array | memoryview | None:
+        stops = self.stops[line]
+        if isinstance(stops, int):
+            return memoryview(self.flat)[self.offsets[stops]:self.offsets[stops + 1]]
+        return stops
+
+    def attach(self: typing.Self, offsets: array, flat: array) -> None:
+        self.stops = list(range(len(offsets) - 1))
+        for line in np.flatnonzero(np.diff(_view(offsets)) == 0).tolist():
+            self.stops[line] = None
+        self.flat = flat
+        self.offsets = offsets
+
+    def clear(self: typing.Self) -> None:
+        self.stops = []
+        del self.colors[:]
+        self.names = []
+        self.flat = array("i")
+        self.offsets = array("I")
+
+    def live(self: typing.Self) -> list[int]:
+        return [line for line, stops in enumerate(self.stops) if stops is not None]
+
+    def get(self: typing.Self, line: int) -> LineState | None:
+        if line >= len(self.stops) or self.stops[line] is None: return None
+        return tuple(self[line]), self.colors[line], self.names[line]
+
+    def put(self: typing.Self, line: int, state: LineState | None) -> None:
+        while len(self.stops) <= line:
+            self.stops.append(None)
+            self.colors.append(0)
+            self.names.append("")
+        if state is None:
+            self.stops[line], self.colors[line], self.names[line] = None, 0, ""
+        else:
+            self.stops[line] = array("i", state[0])
+            self.colors[line], self.names[line] = state[1], state[2]
+        while self.stops and self.stops[-1] is None:
+            self.stops.pop()
+            self.colors.pop()
+            self.names.pop()
+
+class ConnectionStore:
+    def __init__(self: typing.Self, stations: StationStore) -> None:
+        self.stations = stations
+        self.a: array = array("i")
+        self.b: array = array("i")
+        self.colors: array = array("I")
+        self.line: array = array("i")
+        self.stop: array = array("i")
+        self.slot: array = array("i")
+        self.count: array = array("i")
+        self.shifts: tuple[array, array, array, array] = \
+            (array("d"), array("d"), array("d"), array("d"))
+        self.stale: set[int] = set()
+        self.moved: set[tuple[int, int]] = set()
+        self.geometry: tuple[int, int, float] | None = None
+        self.lines: LineStore = LineStore()
+        self.index: dict[int, list[int]] = {}
+        self.incidence: dict[int, list[int]] = {}
+        self.grid: SpatialGrid = SpatialGrid(1 / config.get("cullGridSize", 8))
+
+    def __len__(self: typing.Self) -> int:
+        return len(self.a)
+
+    def clear(self: typing.Self) -> None:
+        del self.a[:], self.b[:], self.colors[:], self.line[:], self.stop[:]
+        del self.slot[:], self.count[:]
+        for column in self.shifts:
+            del column[:]
+        self.stale.clear()
+        self.moved.clear()
+        self.geometry = None
+        self.lines.clear()
+        self.index.clear()
+        self.incidence.clear()
+        self.grid.clear()
+
+    def _insert_grid(self: typing.Self, idx: int) -> None:
+        self.grid.insert(idx, *self.stations.pos(self.a[idx]), *self.stations.pos(self.b[idx]))
+
+    def _link(self: typing.Self, idx: int) -> int:
+        a, b = self.a[idx], self.b[idx]
+        key = _pair_key(a, b)
+        self.index.setdefault(key, []).append(idx)
+        self.incidence.setdefault(a, []).append(idx)
+        if b != a: self.incidence.setdefault(b, []).append(idx)
+        return key
+
+    def _unlink(self: typing.Self, idx: int) -> int:
+        a, b = self.a[idx], self.b[idx]
+        key = _pair_key(a, b)
+        for table, entry in ((self.index, key), (self.incidence, a), (self.incidence, b)):
+            edges = table.get(entry)
+            if edges is None or idx not in edges: continue
+            edges.remove(idx)
+            if not edges: del table[entry]
+        return key
+
+    def _regroup(self: typing.Self, key: int) -> None:
+        parallel = self.index.get(key, [])
+        parallel.sort(key=lambda idx: (self.line[idx], self.stop[idx]))
+        for slot, other in enumerate(parallel):
+            if (self.slot[other], self.count[other]) != (slot, len(parallel)):
+                self.moved.add((self.a[other], self.b[other]))
+            self.slot[other] = slot
+            self.count[other] = len(parallel)
+        self.stale.update(parallel)
+
+    def _append(self: typing.Self, a: int, b: int, color: int, line: int, stop: int) -> int:
+        idx = len(self.a)
+        self.a.append(a)
+        self.b.append(b)
+        self.colors.append(color)
+        self.line.append(line)
+        self.stop.append(stop)
+        self.slot.append(0)
+        self.count.append(1)
+        for column in self.shifts:
+            column.append(0)
+        self._regroup(self._link(idx))
+        self._insert_grid(idx)
+        return idx
+
+    def add(self: typing.Self, a: int, b: int, color: int) -> int:
+        self.set_line(len(self.lines), ((a, b), color, ""))
+        return len(self.a) - 1
+
+    def extend(self: typing.Self, a: np.ndarray, b: np.ndarray, colors: np.ndarray) -> None:
+        self.a.frombytes(np.asarray(a, np.int32).tobytes())
+        self.b.frombytes(np.asarray(b, np.int32).tobytes())
+        self.colors.frombytes(np.asarray(colors, np.uint32).tobytes())
+        self.migrate()
+
+    def segment(self: typing.Self, line: int, stop: int) -> int:
+        stops = self.lines[line]
+        for idx in self.index.get(_pair_key(stops[stop], stops[stop + 1]), ()):
+            if self.line[idx] == line and self.stop[idx] == stop: return idx
+        return -1
+
+    def set_line(self: typing.Self, line: int, state: LineState | None) -> None:
+        old = self.lines.get(line)
+        oldStops = old[0] if old is not None else ()
+        newStops = tuple(state[0]) if state is not None else ()
+        segments = [self.segment(line, stop) for stop in range(len(oldStops) - 1)]
+        shift, lo, hi = _overlap(oldStops, newStops)
+
+        for stop in range(lo, hi):
+            self.stop[segments[stop]] = stop + shift
+            self.colors[segments[stop]] = state[1]
+        kept = segments[lo:hi]
+        for idx in kept[:1] + kept[-1:]:
+            self.stale.add(idx)
+            self.moved.add((self.a[idx], self.b[idx]))
+        for idx in sorted(segments[:lo] + segments[hi:], reverse=True):
+            self.remove(idx)
+        self.lines.put(line, state)
+        if state is None: return
+        for stop in range(len(newStops) - 1):
+            if not lo + shift <= stop < hi + shift:
+                self._append(newStops[stop], newStops[stop + 1], state[1], line, stop)
+
+    def swap(self: typing.Self, i: int, j: int) -> None:
+        if i == j: return
+        keys = {self._unlink(i), self._unlink(j)}
+        for column in (self.a, self.b, self.colors, self.line, self.stop, *self.shifts):
+            column[i], column[j] = column[j], column[i]
+        if (i in self.stale) != (j in self.stale): self.stale ^= {i, j}
+        for idx in (i, j):
+            self._link(idx)
+            self.grid.replace(idx, *self.stations.pos(self.a[idx]), *self.stations.pos(self.b[idx]))
+        for key in keys:
+            self._regroup(key)
+
+    def remove(self: typing.Self, idx: int) -> int:
+        last = len(self.a) - 1
+        self.swap(idx, last)
+        key = self._unlink(last)
+        del self.a[last], self.b[last], self.colors[last], self.line[last], self.stop[last]
+        del self.slot[last], self.count[last]
+        for column in self.shifts:
+            del column[last]
+        self.stale.discard(last)
+        self._regroup(key)
+
+        self.grid.shrink(last)
+        if self.grid.stale > len(self.a): self._rebuild_grid()
+        return last
+
+    def relabel(self: typing.Self, old: int, new: int) -> None:
+        edges = self.incidence.pop(old, [])
+        groups = [self.index.pop(key) for key in
+                  {_pair_key(self.a[idx], self.b[idx]) for idx in edges}]
+        for idx in edges:
+            if self.a[idx] == old: self.a[idx] = new
+            if self.b[idx] == old: self.b[idx] = new
+            if self.count[idx] > 1: self.moved.add((self.a[idx], self.b[idx]))
+        self.stale.update(edges)
+        for parallel in groups:
+            self.index[_pair_key(self.a[parallel[0]], self.b[parallel[0]])] = parallel
+        if edges: self.incidence[new] = edges
+
+        for line in {self.line[idx] for idx in edges}:
+            stops = self.lines[line]
+            for stop, station in enumerate(stops):
+                if station == old: stops[stop] = new
+
+    def cut_station(self: typing.Self, station: int) -> list[tuple[int, LineState | None, LineState | None]]:
+        changes: list[tuple[int, LineState | None, LineState | None]] = []
+        for line in sorted({self.line[idx] for idx in self.incident(station)}):
+            old = self.lines.get(line)
+            stops, color, name = old
+            pieces: list[list[int]] = [[]]
+            for stop in stops:
+                if stop == station: pieces.append([])
+                else: pieces[-1].append(stop)
+            if stops[0] == stops[-1] and stops[0] != station and len(pieces) > 1:
+                pieces[0] = pieces.pop() + pieces[0][1:]
+            states = [(tuple(piece), color, name) for piece in pieces if len(piece) >= 2]
+
+            first = states[0] if states else None
+            self.set_line(line, first)
+            changes.append((line, old, first))
+            for state in states[1:]:
+                extra = len(self.lines)
+                self.set_line(extra, state)
+                changes.append((extra, None, state))
+        return changes
+
+    def migrate(self: typing.Self) -> None:
+        a = _view(self.a).astype(np.int64)
+        b = _view(self.b).astype(np.int64)
+        colors = _view(self.colors).astype(np.int64)
+        count = len(a)
+
+        edges = np.flatnonzero(a != b)
+        keys = np.concatenate(((colors[edges] << 32) | a[edges], (colors[edges] << 32) | b[edges]))
+        order, _, starts, counts = _group(keys)
+        pairs = starts[counts == 2]
+        first, second = order[pairs], order[pairs + 1]
+        ends = np.concatenate((edges, edges))
+        low, high = np.minimum(a, b), np.maximum(a, b)
+        distinct = (low[ends[first]] != low[ends[second]]) | (high[ends[first]] != high[ends[second]])
+        first, second = first[distinct], second[distinct]
+        neighbor = np.full((2, count), -1, np.int64)
+        entry = np.zeros((2, count), np.int64)
+        sides = np.repeat([0, 1], len(edges))
+        neighbor[sides[first], ends[first]] = ends[second]
+        neighbor[sides[second], ends[second]] = ends[first]
+        entry[sides[first], ends[first]] = sides[second]
+        entry[sides[second], ends[second]] = sides[first]
+
+        line = np.arange(count)
+        stop = np.zeros(count, np.int64)
+        flip = np.zeros(count, bool)
+        through = (neighbor >= 0).any(axis=0)
+        loose = np.flatnonzero(through & (neighbor < 0).any(axis=0))
+        looseSides = (neighbor[1, loose] < 0).astype(np.int64)
+        circular = np.flatnonzero(through & (neighbor >= 0).all(axis=0))
+
+        chained, firsts, positions, flips = _walk_chains(
+            neighbor, entry, np.concatenate((loose, circular)),
+            np.concatenate((looseSides, np.zeros(len(circular), np.int64))))
+        line[chained] = firsts
+        stop[chained] = positions
+        flip[chained] = flips
+
+        first = line == np.arange(count)
+        rank = np.cumsum(first) - 1
+        line = rank[line]
+        segments = np.bincount(line, minlength=int(first.sum()))
+        offsets = np.concatenate(([0], np.cumsum(segments + 1)))
+        flat = np.empty(offsets[-1], np.int32)
+        flat[offsets[line] + stop] = np.where(flip, b, a)
+        flat[offsets[line] + stop + 1] = np.where(flip, a, b)
+        self.load((offsets, flat, _view(self.colors)[first], [""] * len(segments)))
+
+    def snapshot(self: typing.Self) -> LineSnapshot:
+        chunks = [self.lines.raw(line) for line in range(len(self.lines))]
+        lengths = np.array([0 if stops is None else len(stops) for stops in chunks], np.int64)
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        flat = np.frombuffer(b"".join(stops for stops in chunks if stops is not None), np.int32)
+        return offsets, flat, _view(self.lines.colors).copy(), list(self.lines.names)
+
+    def load(self: typing.Self, snapshot: LineSnapshot) -> None:
+        offsets, flat, colors, names = snapshot
+        offsets = np.asarray(offsets, np.int64)
+        flat = np.asarray(flat, np.int32)
+        lengths = np.diff(offsets)
+        segments = np.maximum(lengths - 1, 0)
+        line = np.repeat(np.arange(len(lengths)), segments)
+        starts = np.repeat(offsets[:-1], segments)
+        stop = np.arange(len(line)) - np.repeat(np.cumsum(segments) - segments, segments)
+
+        self.clear()
+        self.a = array("i", flat[starts + stop].tobytes())
+        self.b = array("i", flat[starts + stop + 1].tobytes())
+        self.colors = array("I", np.asarray(colors, np.uint32)[line].tobytes())
+        self.line = array("i", line.astype(np.int32).tobytes())
+        self.stop = array("i", stop.astype(np.int32).tobytes())
+        self.lines.colors = array("I", np.asarray(colors, np.uint32).tobytes())
+        self.lines.names = list(names)
+        self.lines.attach(array("I", offsets.astype(np.uint32).tobytes()),
+                          array("i", flat.tobytes()))
+        self.shifts = tuple(array("d", bytes(8 * len(line))) for _ in range(4))
+        self.reindex()
+
+    def reindex(self: typing.Self) -> None:
+        a = _view(self.a).astype(np.int64)
+        b = _view(self.b).astype(np.int64)
+        keys = (np.minimum(a, b) << 32) | np.maximum(a, b)
+
+        order = np.lexsort((_view(self.stop), _view(self.line), keys))
+        uniq, starts, counts = np.unique(keys[order], return_index=True, return_counts=True)
+        slot = np.empty(len(keys), np.int32)
+        slot[order] = np.arange(len(keys)) - np.repeat(starts, counts)
+        self.slot = array("i", slot.tobytes())
+        self.count = array("i", np.repeat(counts, counts)[np.argsort(order)].astype(np.int32).tobytes())
+        self.index = dict(zip(uniq.tolist(), _split(order, starts)))
+
+        loops = a == b
+        order, uniq, starts, _ = _group(np.concatenate((a, b[~loops])))
+        edges = np.concatenate((np.arange(len(a)), np.flatnonzero(~loops)))
+        self.incidence = dict(zip(uniq.tolist(), _split(edges[order], starts)))
+        self._rebuild_grid()
+
+    def _rebuild_grid(self: typing.Self) -> None:
+        a = _view(self.a)
+        b = _view(self.b)
+        xs = _view(self.stations.x)
+        ys = _view(self.stations.y)
+        self.grid.rebuild(xs[a], ys[a], xs[b], ys[b])
+
+    def neighbors(self: typing.Self, idx: int) -> tuple[int, int]:
+        line, stop = self.line[idx], self.stop[idx]
+        stops = self.lines[line]
+        last = len(stops) - 2
+        circular = last > 0 and stops[0] == stops[-1]
+        before = stop - 1 if stop > 0 else last if circular else -1
+        after = stop + 1 if stop < last else 0 if circular else -1
+        return (-1 if before < 0 else self.segment(line, before),
+                -1 if after < 0 else self.segment(line, after))
+
+    def _chains(self: typing.Self) -> tuple[np.ndarray, np.ndarray]:
+        order = np.lexsort((_view(self.stop), _view(self.line)))
+        line = _view(self.line)[order]
+        first = np.ones(len(order), bool)
+        first[1:] = line[1:] != line[:-1]
+        last = np.roll(first, -1)
+        before = np.roll(order, 1)
+        after = np.roll(order, -1)
+        before[first] = -1
+        after[last] = -1
+        heads, tails = order[first], order[last]
+        circular = (heads != tails) & (_view(self.a)[heads] == _view(self.b)[tails])
+        before[np.flatnonzero(first)[circular]] = tails[circular]
+        after[np.flatnonzero(last)[circular]] = heads[circular]
+
+        prevs = np.empty(len(order), np.int64)
+        nexts = np.empty(len(order), np.int64)
+        prevs[order] = before
+        nexts[order] = after
+        return prevs, nexts
+
+    def refresh(self: typing.Self, width: int, height: int, stroke: float) -> None:
+        if self.geometry != (width, height, stroke):
+            ids = np.arange(len(self.a))
+            prevs, nexts = self._chains()
+        elif self.stale:
+            touched = set(self.stale)
+            for idx in self.stale:
+                touched.update(self.neighbors(idx))
+            touched.discard(-1)
+            ids = np.array(sorted(touched), np.int64)
+            prevs, nexts = np.array([self.neighbors(idx) for idx in ids.tolist()],
+                                    np.int64).reshape(-1, 2).T
+        else: return
+
+        self.geometry = (width, height, stroke)
+        self.stale.clear()
+        columns = _shifts(self, ids, prevs, nexts, width, height, stroke)
+        if len(ids) == len(self.a):
+            self.shifts = tuple(array("d", column.tobytes()) for column in columns)
+        else:
+            for column, values in zip(self.shifts, columns):
+                _view(column)[ids] = values
+
+    def incident(self: typing.Self, station: int) -> list[int]:
+        return list(self.incidence.get(station, ()))
+
+    def find_all(self: typing.Self, a: int, b: int) -> list[int]:
+        return list(self.index.get(_pair_key(a, b), ()))
+
+    def termini(self: typing.Self, idx: int) -> tuple[int, int]:
+        return self.a[idx], self.b[idx]
+
+class RiverStore:
+    def __init__(self: typing.Self) -> None:
+        self.x1: array = array("d")
+        self.y1: array = array("d")
+        self.x2: array = array("d")
+        self.y2: array = array("d")
+        self.colors: array = array("I")
+        self.grid: SpatialGrid = SpatialGrid(1 / config.get("cullGridSize", 8))
+
+    def __len__(self: typing.Self) -> int:
+        return len(self.x1)
+
+    def clear(self: typing.Self) -> None:
+        del self.x1[:], self.y1[:], self.x2[:], self.y2[:], self.colors[:]
+        self.grid.clear()
+
+    def add(self: typing.Self, x1: float, y1: float,
+            x2: float, y2: float, color: int) -> int:
+        self.x1.append(x1)
+        self.y1.append(y1)
+        self.x2.append(x2)
+        self.y2.append(y2)
+        self.colors.append(color)
+        self.grid.insert(len(self.x1) - 1, x1, y1, x2, y2)
+        return len(self.x1) - 1
+
+    def swap(self: typing.Self, i: int, j: int) -> None:
+        if i == j: return
+        for column in (self.x1, self.y1, self.x2, self.y2, self.colors):
+            column[i], column[j] = column[j], column[i]
+        for idx in (i, j):
+            self.grid.replace(idx, self.x1[idx], self.y1[idx], self.x2[idx], self.y2[idx])
+
+    def remove(self: typing.Self, idx: int) -> int:
+        last = len(self.x1) - 1
+        self.swap(idx, last)
+        del self.x1[last], self.y1[last], self.x2[last], self.y2[last], self.colors[last]
+
+        self.grid.shrink(last)
+        if self.grid.stale > len(self.x1): self.reindex()
+        return last
+
+    def restore(self: typing.Self, idx: int, x1: float, y1: float,
+                x2: float, y2: float, color: int) -> None:
+        self.swap(idx, self.add(x1, y1, x2, y2, color))
+
+    def reindex(self: typing.Self) -> None:
+        self.grid.rebuild(_view(self.x1), _view(self.y1), _view(self.x2), _view(self.y2))
+
+    def find(self: typing.Self, x1: float, y1: float, x2: float, y2: float) -> int:
+        for idx in range(len(self.x1)):
+            ends = ((self.x1[idx], self.y1[idx]), (self.x2[idx], self.y2[idx]))
+            if ends == ((x1, y1), (x2, y2)) or ends == ((x2, y2), (x1, y1)):
+                return idx
+        return -1
+
+    def termini(self: typing.Self, idx: int) -> tuple["Coordinate", "Coordinate"]:
+        return (_coord(self.x1[idx], self.y1[idx]),
+                _coord(self.x2[idx], self.y2[idx]))
+
+def int2col(color: int) -> tuple[int, int, int]:
+    return color // 65536 % 256, color // 256 % 256, color % 256
+
+def col2int(color: tuple[int, int, int]) -> int:
+    return color[0] * 65536 + color[1] * 256 + color[2]
+
+def set_root(surface: pygame.Surface) -> None:
+    global root
+    root = surface
+
+def _coord(x: float, y: float) -> Coordinate:
+    c = Coordinate(x, y)
+    c.set_root(root)
+    return c
+
+def _grid_key(x: float, y: float) -> int:
+    return (math.floor(x * grid + 0.5) << 32) + math.floor(y * grid + 0.5)
+
+def _pair_key(a: int, b: int) -> int:
+    return (a << 32) | b if a <= b else (b << 32) | a
+
+def _overlap(old: tuple[int, ...], new: tuple[int, ...]) -> tuple[int, int, int]:
+    if len(old) < 2 or len(new) < 2: return 0, 0, 0
+    if len(old) <= len(new):
+        for shift in range(len(new) - len(old) + 1):
+            if new[shift:shift + len(old)] == old: return shift, 0, len(old) - 1
+    else:
+        for start in range(len(old) - len(new) + 1):
+            if old[start:start + len(new)] == new: return -start, start, start + len(new) - 1
+    return 0, 0, 0
+
+def _walk_chains(neighbor: np.ndarray, entry: np.ndarray, starts: np.ndarray,
+                 sides: np.ndarray) -> tuple[list[int], list[int], list[int], list[bool]]:
+    chained: list[int] = []
+    firsts: list[int] = []
+    positions: list[int] = []
+    flips: list[bool] = []
+    if not len(starts): return chained, firsts, positions, flips
+
+    nextEdge = [neighbor[0].tolist(), neighbor[1].tolist()]
+    nextSide = [entry[0].tolist(), entry[1].tolist()]
+    used = bytearray(neighbor.shape[1])
+    for edge, side in zip(starts.tolist(), sides.tolist()):
+        if used[edge]: continue
+        start = len(chained)
+        while edge >= 0 and not used[edge]:
+            used[edge] = 1
+            chained.append(edge)
+            flips.append(side == 1)
+            edge, side = nextEdge[1 - side][edge], nextSide[1 - side][edge]
+        firsts += [min(chained[start:])] * (len(chained) - start)
+        positions += range(len(chained) - start)
+    return chained, firsts, positions, flips
+
+def _normals(connections: ConnectionStore, ids: np.ndarray, width: int, height: int,
+             stroke: float) -> tuple[np.ndarray, np.ndarray]:
+    a = _view(connections.a)[ids]
+    b = _view(connections.b)[ids]
+    xs = _view(connections.stations.x)
+    ys = _view(connections.stations.y)
+    direction = (np.floor(xs[b] * width) - np.floor(xs[a] * width)
+                 + 1j * (np.floor(ys[b] * height) - np.floor(ys[a] * height)))
+    length = np.abs(direction)
+    su = _view(connections.slot)[ids] - (_view(connections.count)[ids] - 1) / 2
+    canonical = np.where(length > 0, direction * np.where(a <= b, 1, -1), 1)
+    offset = canonical * 1j * stroke * su / np.where(length > 0, length, 1)
+    return np.floor(offset.real + 0.5) + 1j * np.floor(offset.imag + 0.5), direction
+
+def _mitre(offset: np.ndarray, direction: np.ndarray, otherOffset: np.ndarray,
+           otherDirection: np.ndarray) -> np.ndarray:
+    cross = (direction.conj() * otherDirection).imag
+    bent = np.abs(cross) > 1e-6 * np.abs(direction) * np.abs(otherDirection)
+    along = np.divide(((otherOffset - offset).conj() * otherDirection).imag, cross,
+                      out=np.zeros(len(cross)), where=bent)
+    corner = offset + along * direction
+    sharp = ~bent | (np.abs(corner) > 2 * np.maximum(np.abs(offset), np.abs(otherOffset)))
+    corner[sharp] = (offset[sharp] + otherOffset[sharp]) / 2
+    return corner
+
+def _shifts(connections: ConnectionStore, ids: np.ndarray, prevs: np.ndarray,
+            nexts: np.ndarray, width: int, height: int,
+            stroke: float) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    prevs = np.where(prevs >= 0, prevs, ids)
+    nexts = np.where(nexts >= 0, nexts, ids)
+    if len(ids) == len(connections):
+        every = ids
+        rows = ids, prevs, nexts
+    else:
+        every = np.unique(np.concatenate((ids, prevs, nexts)))
+        rows = tuple(np.searchsorted(every, column) for column in (ids, prevs, nexts))
+    offsets, directions = _normals(connections, every, width, height, stroke)
+    offset, direction = offsets[rows[0]], directions[rows[0]]
+    ends = []
+    for other in rows[1:]:
+        end = offset.copy()
+        joined = np.flatnonzero(offsets[other] != offset)
+        end[joined] = _mitre(offset[joined], direction[joined],
+                             offsets[other[joined]], directions[other[joined]])
+        ends.append(end)
+    return ends[0].real / width, ends[0].imag / height, ends[1].real / width, ends[1].imag / height
+
+def _view(column: array) -> np.ndarray:
+    return np.frombuffer(column, dtype=column.typecode)
+
+def _split(values: np.ndarray, starts: np.ndarray) -> list[list[int]]:
+    values = values.tolist()
+    bounds = starts.tolist() + [len(values)]
+    return [values[bounds[idx]:bounds[idx + 1]] for idx in range(len(bounds) - 1)]
+
+def _group(keys: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    order = np.argsort(keys, kind="stable")
+    uniq, starts, counts = np.unique(keys[order], return_index=True, return_counts=True)
+    return order, uniq, starts, counts
+
+def parse_color(color: str | int) -> int:
+    if "paletteColors" in config.keys() and color.startswith("$"):
+        paletteColor = config["paletteColors"].get(color[1:], None)
+        if paletteColor is not None:
+            color = int(paletteColor)
+        else:
+            return -1
+
+    if not isinstance(color, int):
+        if color.startswith("#"):
+            try:
+                color = int(color.strip("#"), 16)
+            except ValueError:
+                pass
+
+    if not isinstance(color, int):
+        try:
+            color = int(color)
+        except ValueError:
+            return -2
+        
+    if color < 0: color = 0
+    if color > 0xFFFFFF: color = 0xFFFFFF
+    
+    return color
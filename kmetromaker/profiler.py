@@ -0,0 +1,129 @@
+import sys, csv, json, time, typing, contextlib
+from collections import deque
+from pathlib import Path
+
+Span = tuple[str, float, float]
+Frame = tuple[float, float, list[Span], dict[str, int]]
+
+phases: tuple[str, ...] = ("idle", "events", "cull", "clear", "rivers", "connections",
+                           "stations", "tiles", "overlay", "flip")
+
+class Profiler:
+    def __init__(self: typing.Self, depth: int) -> None:
+        self.frames: deque[Frame] = deque(maxlen=max(1, depth))
+        self.spans: list[Span] = []
+        self.counters: dict[str, int] = {}
+        self.start: float = time.perf_counter()
+        self.blocks: int = sys.getallocatedblocks()
+        self.epoch: float = self.start
+        self.active: bool = False
+        self.hud: bool = False
+
+    def __len__(self: typing.Self) -> int:
+        return len(self.frames)
+
+    def begin_frame(self: typing.Self) -> None:
+        self.spans = []
+        self.counters = {}
+        self.start = time.perf_counter()
+        self.blocks = sys.getallocatedblocks()
+        self.active = True
+
+    def end_frame(self: typing.Self) -> None:
+        self.count("blocks", sys.getallocatedblocks() - self.blocks)
+        self.frames.append((self.start, time.perf_counter(), self.spans, self.counters))
+        self.active = False
+
+    @contextlib.contextmanager
+    def phase(self: typing.Self, name: str) -> typing.Iterator[None]:
+        if not self.active:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans.append((name, start, time.perf_counter() - start))
+
+    def count(self: typing.Self, name: str, amount: int = 1) -> None:
+        if self.active: self.counters[name] = self.counters.get(name, 0) + amount
+
+    def clear(self: typing.Self) -> None:
+        self.frames.clear()
+
+    def drawn(self: typing.Self) -> list[Frame]:
+        return [frame for frame in self.frames
+                if any(span[0] == "flip" for span in frame[2])]
+
+    def busy(self: typing.Self, frame: Frame) -> float:
+        return frame[1] - frame[0] - sum(span[2] for span in frame[2] if span[0] == "idle")
+
+    def totals(self: typing.Self, frame: Frame) -> dict[str, float]:
+        totals: dict[str, float] = {}
+        stack: list[tuple[str, float]] = []
+        for name, start, duration in sorted(frame[2], key=lambda span: (span[1], -span[2])):
+            while stack and stack[-1][1] <= start: stack.pop()
+            if stack: totals[stack[-1][0]] -= duration
+            totals[name] = totals.get(name, 0) + duration
+            stack.append((name, start + duration))
+        return totals
+
+    def fps(self: typing.Self, window: float = 1) -> float:
+        drawn = self.drawn()
+        if not drawn: return 0
+        recent = [frame for frame in drawn if frame[1] >= drawn[-1][1] - window]
+        if len(recent) < 2: return 0
+        return (len(recent) - 1) / max(recent[-1][1] - recent[0][1], 1e-9)
+
+    def percentiles(self: typing.Self, *points: float) -> list[float]:
+        times = sorted(self.busy(frame) for frame in self.drawn())
+        if not times: return [0 for _ in points]
+        return [times[min(len(times) - 1, int(point / 100 * len(times)))] for point in points]
+
+    def summary(self: typing.Self) -> list[tuple[str, str]]:
+        drawn = self.drawn()
+        p50, p95, p99 = self.percentiles(50, 95, 99)
+        lines = [("FPS", f"{self.fps():.1f}"), ("frames", f"{len(drawn)}"),
+                 ("p50", f"{p50 * 1000:.2f} ms"), ("p95", f"{p95 * 1000:.2f} ms"),
+                 ("p99", f"{p99 * 1000:.2f} ms")]
+        if not drawn: return lines
+
+        totals = self.totals(drawn[-1])
+        lines += [(name, f"{totals[name] * 1000:.2f} ms")
+                  for name in phases if name in totals and name != "idle"]
+        lines += [(name, f"{value}") for name, value in sorted(drawn[-1][3].items())]
+        return lines
+
+    def _columns(self: typing.Self) -> tuple[list[str], list[str]]:
+        names = {span[0] for frame in self.frames for span in frame[2]}
+        counters = {name for frame in self.frames for name in frame[3]}
+        return ([name for name in phases if name in names] + sorted(names - set(phases)),
+                sorted(counters))
+
+    def write_csv(self: typing.Self, filename: str) -> None:
+        names, counters = self._columns()
+        with open(filename, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["frame", "start_ms", "total_ms", "busy_ms"]
+                            + [f"{name}_ms" for name in names] + counters)
+            for number, frame in enumerate(self.frames):
+                totals = self.totals(frame)
+                writer.writerow([number, f"{(frame[0] - self.epoch) * 1000:.3f}",
+                                 f"{(frame[1] - frame[0]) * 1000:.3f}",
+                                 f"{self.busy(frame) * 1000:.3f}"]
+                                + [f"{totals.get(name, 0) * 1000:.3f}" for name in names]
+                                + [frame[3].get(name, 0) for name in counters])
+
+    def write_trace(self: typing.Self, filename: str) -> None:
+        events: list[dict[str, typing.Any]] = []
+        for number, (start, end, spans, counters) in enumerate(self.frames):
+            events.append({"name": "frame", "ph": "X", "pid": 1, "tid": 1,
+                           "ts": (start - self.epoch) * 1e6, "dur": (end - start) * 1e6,
+                           "args": {"frame": number}})
+            events += [{"name": name, "ph": "X", "pid": 1, "tid": 1,
+                        "ts": (begin - self.epoch) * 1e6, "dur": duration * 1e6}
+                       for name, begin, duration in spans]
+            if counters:
+                events.append({"name": "counters", "ph": "C", "pid": 1, "tid": 1,
+                               "ts": (start - self.epoch) * 1e6, "args": counters})
+        Path(filename).write_text(json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}))
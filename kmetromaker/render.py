@@ -0,0 +1,584 @@
+import pygame, pygame.freetype, math, os
+import numpy as np
+from collections import OrderedDict
+from enum import Flag, auto
+from .config import config, resourcesPath
+from .model import (Coordinate, TextDirection, SpatialGrid, StationStore,
+                    ConnectionStore, RiverStore, int2col, _view)
+from .tiles import TileCache
+from .profiler import Profiler
+
+class Layer(Flag):
+    RIVERS = auto()
+    CONNECTIONS = auto()
+    STATIONS = auto()
+    ALL = RIVERS | CONNECTIONS | STATIONS
+
+window: pygame.Surface | None = None
+font: pygame.freetype.Font | None = None
+textdis = config.get("nameDistance", 15)
+
+zoom: float = 1.0
+pan: Coordinate = Coordinate()
+pan.set_root(window)
+canvasSize: tuple[int, int] | None = None
+canvasOrigin: tuple[int, int] = (0, 0)
+
+redrawOnDemand: bool = config.get("redrawOnDemand", True)
+redrawAll: bool = True
+dirtyRects: list[pygame.Rect] = []
+
+tiles: TileCache | None = None
+tileSize: int = max(16, config.get("tileSize", 256))
+tileLayers: tuple[Layer, ...] = (Layer.RIVERS, Layer.CONNECTIONS, Layer.STATIONS)
+
+labelCache: OrderedDict[tuple[str, float, tuple[int, int, int]], pygame.Surface] = OrderedDict()
+labelCacheBytes: int = 0
+labelCacheBudget: int = int(config.get("labelCacheSize", 32) * 1024 * 1024)
+labelMetrics: dict[str, tuple[int, int]] = {}
+
+profiler: Profiler = Profiler(config.get("profilerFrames", 1000))
+
+stations: StationStore = StationStore()
+connections: ConnectionStore = ConnectionStore(stations)
+rivers: RiverStore = RiverStore()
+
+stationIds: np.ndarray = np.zeros(0, np.int64)
+stationScreen: np.ndarray = np.zeros((0, 2), np.int32)
+connectionIds: np.ndarray = np.zeros(0, np.int64)
+connectionScreen: np.ndarray = np.zeros((0, 4), np.int32)
+riverIds: np.ndarray = np.zeros(0, np.int64)
+riverScreen: np.ndarray = np.zeros((0, 4), np.int32)
+
+def init_headless() -> None:
+    if pygame.get_init(): return
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    pygame.init()
+
+def init(surface: pygame.Surface, tiled: bool = False) -> None:
+    global window
+    global font
+    global tiles
+
+    window = surface
+    if tiles is not None: tiles.clear()
+    tiles = TileCache(window, int(config.get("tileCacheSize", 64) * 1024 * 1024),
+                      int(config.get("tileDiskCacheSize", 512) * 1024 * 1024),
+                      config.get("tileCacheDir", "")) if tiled else None
+    pan.set_root(window)
+    if font is None:
+        font = pygame.freetype.Font(config.get("font", str(
+            resourcesPath.joinpath("Roboto.ttf")
+        )), config.get("nameTextSize", 24))
+    invalidate_labels()
+    mark_dirty()
+
+def set_model(model: tuple[StationStore, ConnectionStore, RiverStore]) -> None:
+    global stations
+    global connections
+    global rivers
+
+    old = stations
+    stations, connections, rivers = model
+    if old is not stations: old.clear()
+    invalidate_labels()
+    invalidate_tiles()
+    mark_dirty()
+
+def _text_pos(
+        origin: tuple[int, int],
+        rect: pygame.Rect,
+        dir: TextDirection) -> pygame.Rect:
+    rect.center = origin
+    
+    if TextDirection.LEFT in dir:
+        rect.right = origin[0] - textdis * zoom
+    if TextDirection.RIGHT in dir:
+        rect.left = origin[0] + textdis * zoom
+    if TextDirection.UP in dir:
+        rect.bottom = origin[1] - textdis * zoom
+    if TextDirection.DOWN in dir:
+        rect.top = origin[1] + textdis * zoom
+    return rect
+
+def _screen_axis(v: np.ndarray, size: int, offset: float) -> np.ndarray:
+    return ((np.floor(v * size) - size // 2) * zoom + size // 2) / size + offset * zoom
+
+def _canvas() -> tuple[int, int]:
+    return canvasSize or window.get_size()
+
+def _to_screen(x: float, y: float) -> tuple[int, int]:
+    width, height = _canvas()
+    return (math.floor(_screen_axis(x, width, pan.x) * width) - canvasOrigin[0],
+            math.floor(_screen_axis(y, height, pan.y) * height) - canvasOrigin[1])
+
+def _to_world(x: int, y: int) -> tuple[float, float]:
+    width, height = _canvas()
+    x += canvasOrigin[0]
+    y += canvasOrigin[1]
+    return (((x - width // 2 - pan.x * zoom * width) / zoom + width // 2) / width,
+            ((y - height // 2 - pan.y * zoom * height) / zoom + height // 2) / height)
+
+def _query_view(grid: SpatialGrid, view: pygame.Rect, margin: float) -> np.ndarray:
+    margin = math.ceil(margin) + 2
+    x1, y1 = _to_world(view.left - margin, view.top - margin)
+    x2, y2 = _to_world(view.right + margin, view.bottom + margin)
+    return grid.query(x1, y1, x2, y2)
+
+def _lod_labels() -> bool:
+    return 24 * zoom >= config.get("lodLabelSize", 6)
+
+def _lod_stations() -> bool:
+    return zoom * (config.get("stationStroke", 2) + config.get("stationSize", 8)) \
+        >= config.get("lodStationSize", 3)
+
+def _lod_merge() -> bool:
+    return zoom < config.get("lodMergeZoom", 0.25)
+
+def transform_frame(view: pygame.Rect | None = None) -> None:
+    global stationIds
+    global stationScreen
+    global connectionIds
+    global connectionScreen
+    global riverIds
+    global riverScreen
+
+    width, height = _canvas()
+    left, top = canvasOrigin
+    stroke = config.get("connectionStroke", 6)
+    if view is None: view = window.get_rect()
+
+    labelReach = textdis + 24 * (stations.longest + 1) if _lod_labels() else 0
+    stationIds = _query_view(stations.grid, view, zoom * (
+        config.get("stationStroke", 2) + config.get("stationSize", 8) + labelReach))
+    connectionIds = _query_view(connections.grid, view,
+        stroke * zoom + stroke * _view(connections.count).max(initial=1))
+    if _lod_merge():
+        connectionIds = connectionIds[_view(connections.slot)[connectionIds] == 0]
+    riverIds = _query_view(rivers.grid, view, config.get("riverStroke", 25) * zoom)
+
+    xs = _view(stations.x)
+    ys = _view(stations.y)
+
+    stationScreen = np.empty((len(stationIds), 2), np.int32)
+    stationScreen[:, 0] = np.floor(_screen_axis(xs[stationIds], width, pan.x) * width) - left
+    stationScreen[:, 1] = np.floor(_screen_axis(ys[stationIds], height, pan.y) * height) - top
+
+    a = _view(connections.a)[connectionIds]
+    b = _view(connections.b)[connectionIds]
+    if _lod_merge(): shifts = np.zeros((4, len(connectionIds)))
+    else:
+        connections.refresh(width, height, stroke)
+        shifts = np.stack([_view(column)[connectionIds] for column in connections.shifts])
+    connectionScreen = np.empty((len(connectionIds), 4), np.int32)
+    connectionScreen[:, 0] = np.floor((_screen_axis(xs[a], width, pan.x) + shifts[0]) * width) - left
+    connectionScreen[:, 1] = np.floor((_screen_axis(ys[a], height, pan.y) + shifts[1]) * height) - top
+    connectionScreen[:, 2] = np.floor((_screen_axis(xs[b], width, pan.x) + shifts[2]) * width) - left
+    connectionScreen[:, 3] = np.floor((_screen_axis(ys[b], height, pan.y) + shifts[3]) * height) - top
+
+    riverScreen = np.empty((len(riverIds), 4), np.int32)
+    riverScreen[:, 0] = np.floor(_screen_axis(_view(rivers.x1)[riverIds], width, pan.x) * width) - left
+    riverScreen[:, 1] = np.floor(_screen_axis(_view(rivers.y1)[riverIds], height, pan.y) * height) - top
+    riverScreen[:, 2] = np.floor(_screen_axis(_view(rivers.x2)[riverIds], width, pan.x) * width) - left
+    riverScreen[:, 3] = np.floor(_screen_axis(_view(rivers.y2)[riverIds], height, pan.y) * height) - top
+
+def _surface_bytes(surface: pygame.Surface) -> int:
+    return surface.get_width() * surface.get_height() * surface.get_bytesize()
+
+def _label_surface(name: str, color: tuple[int, int, int] = (0, 0, 0)) -> pygame.Surface:
+    global labelCacheBytes
+    key = (name, zoom, color)
+    surface = labelCache.get(key)
+    if surface is not None:
+        labelCache.move_to_end(key)
+        profiler.count("labelHits")
+        return surface
+
+    surface, _ = font.render(name, fgcolor=color, size=24 * zoom)
+    profiler.count("labelMisses")
+    profiler.count("surfaces")
+    labelCache[key] = surface
+    labelCacheBytes += _surface_bytes(surface)
+
+    while labelCacheBytes > labelCacheBudget and len(labelCache) > 1:
+        _, old = labelCache.popitem(last=False)
+        labelCacheBytes -= _surface_bytes(old)
+    return surface
+
+def _label_bounds(name: str, where: tuple[int, int], dir: TextDirection) -> pygame.Rect:
+    size = labelMetrics.get(name)
+    if size is None:
+        size = labelMetrics[name] = font.get_rect(name, size=24).size
+    rect = pygame.Rect(0, 0, math.ceil(size[0] * zoom * 1.1) + 4,
+                       math.ceil(size[1] * zoom * 1.1) + 4)
+    return _text_pos(where, rect, dir)
+
+def invalidate_labels(name: str | None = None) -> None:
+    global labelCacheBytes
+    if name is None:
+        labelCache.clear()
+        labelCacheBytes = 0
+        return
+    labelMetrics.pop(name, None)
+    for key in [key for key in labelCache if key[0] == name]:
+        labelCacheBytes -= _surface_bytes(labelCache.pop(key))
+
+def station_rect(station: int) -> pygame.Rect:
+    where = _to_screen(*stations.pos(station))
+    radius = math.ceil(zoom * (config.get("stationStroke", 2) + config.get("stationSize", 8))) + 1
+    rect = pygame.Rect(0, 0, radius * 2, radius * 2)
+    rect.center = where
+
+    return rect.union(_label_bounds(stations.names[station], where, stations.dir(station)))
+
+def _segment_rect(termini: tuple[tuple[float, float]], stroke: float) -> pygame.Rect:
+    points = [_to_screen(*t) for t in termini]
+    xs = [p[0] for p in points]
+    ys = [p[1] for p in points]
+    pad = math.ceil(stroke) + 2
+    return pygame.Rect(
+        min(xs) - pad, min(ys) - pad,
+        max(xs) - min(xs) + pad * 2, max(ys) - min(ys) + pad * 2)
+
+def connection_rect(termini: tuple[int, int]) -> pygame.Rect:
+    parallel = len(connections.find_all(*termini)) + 1
+    return _segment_rect(tuple(stations.pos(t) for t in termini),
+                         config.get("connectionStroke", 6) * max(zoom, 1) * parallel)
+
+def river_rect(river: int) -> pygame.Rect:
+    return _segment_rect(tuple(t.get_pos() for t in rivers.termini(river)),
+                         config.get("riverStroke", 25) * zoom)
+
+def _tile_shift() -> tuple[int, int]:
+    width, height = _canvas()
+    return math.floor(pan.x * zoom * width), math.floor(pan.y * zoom * height)
+
+def invalidate_tiles(rect: pygame.Rect | None = None, layers: Layer = Layer.ALL) -> None:
+    if tiles is None or not layers: return
+    if rect is None and layers == Layer.ALL:
+        tiles.clear()
+        return
+
+    width, height = _canvas()
+    if rect is not None: rect = rect.move(*(-shift for shift in _tile_shift()))
+    margin = config.get("lodClusterSize", 8) + 8
+    for level in tiles.levels():
+        if not level[3] & layers.value: continue
+        if rect is None:
+            tiles.discard(level)
+            continue
+        scale = level[0] / zoom
+        x1 = math.floor((rect.left - width // 2) * scale + width // 2) - margin
+        y1 = math.floor((rect.top - height // 2) * scale + height // 2) - margin
+        x2 = math.ceil((rect.right - width // 2) * scale + width // 2) + margin
+        y2 = math.ceil((rect.bottom - height // 2) * scale + height // 2) + margin
+        tiles.discard(level, (x1 // tileSize, y1 // tileSize, x2 // tileSize, y2 // tileSize))
+
+def mark_dirty(rect: pygame.Rect | None = None, layers: Layer = Layer.ALL) -> None:
+    global redrawAll
+    if rect is None:
+        redrawAll = True
+        return
+    invalidate_tiles(rect, layers)
+    rect = rect.clip(window.get_rect())
+    if rect.width and rect.height:
+        dirtyRects.append(rect)
+
+def mark_dirty_rects(rects: list[pygame.Rect], layers: Layer = Layer.ALL) -> None:
+    merged: list[pygame.Rect] = []
+    for rect in sorted(rects, key=lambda rect: (rect.left, rect.top)):
+        for idx, other in enumerate(merged):
+            union = other.union(rect)
+            if union.w * union.h <= other.w * other.h + rect.w * rect.h:
+                merged[idx] = union
+                break
+        else: merged.append(rect)
+    for rect in merged:
+        mark_dirty(rect, layers)
+
+def draw_station(station: int, where: tuple[int, int], label: bool = True) -> None:
+    pygame.draw.circle(
+        window, (0, 0, 0),
+        where,
+        zoom * (config.get("stationStroke", 2) + config.get("stationSize", 8)))
+    
+    pygame.draw.circle(
+        window, (255, 255, 255),
+        where,
+        zoom * config.get("stationSize", 8))
+
+    if not label: return
+    name = stations.names[station]
+    dir = stations.dir(station)
+    if _label_bounds(name, where, dir).colliderect(window.get_clip()):
+        label = _label_surface(name)
+        window.blit(label, _text_pos(where, label.get_rect(), dir))
+
+def draw_station_markers(points: np.ndarray) -> None:
+    clip = window.get_clip()
+
+    if config.get("lodStationMode", "cluster") == "cluster":
+        size = config.get("lodClusterSize", 8)
+        near = clip.inflate(size * 2, size * 2)
+        points = points[(points[:, 0] >= near.left) & (points[:, 0] < near.right)
+                        & (points[:, 1] >= near.top) & (points[:, 1] < near.bottom)]
+        cells, counts = np.unique((points.astype(np.int64) + canvasOrigin) // size,
+                                  axis=0, return_counts=True)
+        for (cx, cy), count in zip(cells.tolist(), counts.tolist()):
+            where = (cx * size + size // 2 - canvasOrigin[0],
+                     cy * size + size // 2 - canvasOrigin[1])
+            pygame.draw.circle(window, (0, 0, 0), where, 3 if count > 1 else 2)
+        return
+
+    points = points[(points[:, 0] >= clip.left) & (points[:, 0] < clip.right)
+                    & (points[:, 1] >= clip.top) & (points[:, 1] < clip.bottom)]
+
+    pixels = pygame.surfarray.pixels2d(window)
+    pixels[points[:, 0], points[:, 1]] = window.map_rgb((0, 0, 0))
+    del pixels
+
+def _connection_stroke() -> int:
+    return pygame.math.clamp(math.floor(config.get("connectionStroke", 6) * zoom), 1, 10000)
+
+def draw_connection(cidx: int, termini: tuple[int, int, int, int]) -> None:
+    pygame.draw.line(
+        window, int2col(connections.colors[cidx]), termini[:2], termini[2:],
+        _connection_stroke()
+    )
+
+def _plot_pixels(points: np.ndarray, colors: np.ndarray) -> None:
+    clip = window.get_clip()
+    inside = ((points[:, 0] >= clip.left) & (points[:, 0] < clip.right)
+              & (points[:, 1] >= clip.top) & (points[:, 1] < clip.bottom))
+    pixels = pygame.surfarray.pixels2d(window)
+    for color in np.unique(colors[inside]).tolist():
+        match = points[inside & (colors == color)]
+        pixels[match[:, 0], match[:, 1]] = window.map_rgb(int2col(color))
+    del pixels
+
+def draw_connections(ids: np.ndarray, screen: np.ndarray) -> None:
+    colors = _view(connections.colors)[ids]
+    stroke = _connection_stroke()
+
+    if stroke == 1 and _lod_merge():
+        tiny = np.abs(screen[:, :2] - screen[:, 2:]).max(axis=1, initial=0) <= 1
+        _plot_pixels(np.concatenate((screen[tiny, :2], screen[tiny, 2:])),
+                     np.concatenate((colors[tiny], colors[tiny])))
+        ids = ids[~tiny]
+        screen = screen[~tiny]
+        colors = colors[~tiny]
+
+    lineIds = _view(connections.line)[ids]
+    stops = _view(connections.stop)[ids]
+    order = np.lexsort((stops, lineIds))
+    lineIds, stops, screen, colors = lineIds[order], stops[order], screen[order], colors[order]
+    joined = ((lineIds[1:] == lineIds[:-1]) & (stops[1:] == stops[:-1] + 1)
+              & (screen[1:, :2] == screen[:-1, 2:]).all(axis=1))
+    breaks = np.flatnonzero(~joined) + 1
+    starts = np.concatenate(([0], breaks)).tolist() if len(screen) else []
+    ends = np.concatenate((breaks, [len(screen)])).tolist()
+    profiler.count("polylinesDrawn", len(starts))
+
+    line = pygame.draw.line
+    lines = pygame.draw.lines
+    heads = screen[:, :2].tolist()
+    tails = screen[:, 2:].tolist()
+    colors = colors.tolist()
+    palette: dict[int, tuple[int, int, int]] = {}
+    for start, end in zip(starts, ends):
+        rgb = palette.get(colors[start])
+        if rgb is None: rgb = palette[colors[start]] = int2col(colors[start])
+        if end - start == 1: line(window, rgb, heads[start], tails[start], stroke)
+        else: lines(window, rgb, False, [heads[start]] + tails[start:end], stroke)
+
+def draw_river(river: int, termini: tuple[int, int, int, int]) -> None:
+    color = int2col(rivers.colors[river])
+    t1 = termini[:2]
+    t2 = termini[2:]
+
+    riverStroke = pygame.math.clamp(math.floor(config.get("riverStroke", 25) * zoom), 1, 1000)
+
+    pygame.draw.line(
+        window, color, t1, t2,
+        riverStroke
+    )
+    pygame.draw.circle(
+        window, color, t1,
+        riverStroke / 2
+    )
+    pygame.draw.circle(
+        window, color, t2,
+        riverStroke / 2
+    )
+
+def _draw_layers(view: pygame.Rect, targets: dict[Layer, pygame.Surface]) -> None:
+    global window
+
+    saved = window
+    with profiler.phase("cull"):
+        transform_frame(view)
+    try:
+        for layer, target in targets.items():
+            window = target
+            window.set_clip(view)
+
+            if Layer.RIVERS in layer:
+                with profiler.phase("clear"):
+                    pygame.draw.rect(
+                        window, (255, 255, 255),
+                        (0, 0, window.get_width(), window.get_height())
+                    ) 
+
+                with profiler.phase("rivers"):
+                    for river, termini in zip(riverIds.tolist(), riverScreen.tolist()):
+                        draw_river(river, termini)
+                profiler.count("riversDrawn", len(riverIds))
+
+            if Layer.CONNECTIONS in layer:
+                with profiler.phase("connections"):
+                    draw_connections(connectionIds, connectionScreen)
+                profiler.count("connectionsDrawn", len(connectionIds))
+
+            if Layer.STATIONS in layer:
+                with profiler.phase("stations"):
+                    if not _lod_stations():
+                        draw_station_markers(stationScreen)
+                    else:
+                        labels = _lod_labels()
+                        for station, where in zip(stationIds.tolist(), stationScreen.tolist()):
+                            draw_station(station, where, labels)
+                profiler.count("stationsDrawn", len(stationIds))
+
+            window.set_clip(None)
+    finally:
+        window = saved
+
+def stroke_padding(layers: Layer = Layer.ALL) -> int:
+    stroke = 0
+    if Layer.RIVERS in layers: stroke = config.get("riverStroke", 25)
+    if Layer.CONNECTIONS in layers: stroke = max(stroke, config.get("connectionStroke", 6))
+    return math.ceil(stroke * zoom / 2) + 2
+
+def draw_canvas(size: tuple[int, int], origin: tuple[int, int],
+                layers: tuple[Layer, ...] = (Layer.ALL,)) -> list[pygame.Surface]:
+    global pan
+    global canvasSize
+    global canvasOrigin
+
+    saved = (pan, canvasSize, canvasOrigin)
+    canvasSize = _canvas()
+    pan = Coordinate()
+    surfaces: dict[Layer, pygame.Surface] = {}
+    try:
+        for pad in sorted({stroke_padding(layer) for layer in layers}):
+            padded = (size[0] + pad * 2, size[1] + pad * 2)
+            canvasOrigin = (origin[0] - pad, origin[1] - pad)
+            targets = {layer: pygame.Surface(padded, 0, window) if Layer.RIVERS in layer
+                       else pygame.Surface(padded, pygame.SRCALPHA)
+                       for layer in layers if stroke_padding(layer) == pad}
+            profiler.count("surfaces", len(targets))
+            _draw_layers(pygame.Rect((0, 0), padded), targets)
+            for layer, target in targets.items():
+                surfaces[layer] = target.subsurface((pad, pad, *size)).copy()
+    finally:
+        pan, canvasSize, canvasOrigin = saved
+    return [surfaces[layer] for layer in layers]
+
+def _tile(level: tuple[float, int, int], tx: int, ty: int) -> pygame.Surface:
+    key = ((*level, Layer.ALL.value), tx, ty)
+    tile = tiles.get(key)
+    if tile is not None:
+        profiler.count("tileHits")
+        return tile
+    profiler.count("tileMisses")
+
+    keys = [((*level, layer.value), tx, ty) for layer in tileLayers]
+    parts = [tiles.get(part) for part in keys]
+    missing = tuple(layer for layer, part in zip(tileLayers, parts) if part is None)
+    if missing:
+        drawn = iter(draw_canvas((tileSize, tileSize), (tx * tileSize, ty * tileSize), missing))
+        parts = [next(drawn) if part is None else part for part in parts]
+        for layer, part, surface in zip(tileLayers, keys, parts):
+            if layer in missing: tiles.put(part, surface)
+
+    tile = parts[0].copy()
+    for surface in parts[1:]:
+        tile.blit(surface, (0, 0))
+    tiles.put(key, tile)
+    return tile
+
+def _prepare_tiles(level: tuple[float, int, int], columns: range, rows: range) -> None:
+    missing: dict[tuple[int, int], list[Layer]] = {}
+    for ty in rows:
+        for tx in columns:
+            if tiles.get(((*level, Layer.ALL.value), tx, ty)) is not None: continue
+            layers = [layer for layer in tileLayers
+                      if tiles.get(((*level, layer.value), tx, ty)) is None]
+            if layers: missing[tx, ty] = layers
+    if not missing: return
+
+    x1 = min(tx for tx, _ in missing)
+    y1 = min(ty for _, ty in missing)
+    x2 = max(tx for tx, _ in missing)
+    y2 = max(ty for _, ty in missing)
+    layers = tuple(layer for layer in tileLayers
+                   if any(layer in needed for needed in missing.values()))
+    drawn = draw_canvas(((x2 - x1 + 1) * tileSize, (y2 - y1 + 1) * tileSize),
+                        (x1 * tileSize, y1 * tileSize), layers)
+
+    for (tx, ty), needed in missing.items():
+        area = ((tx - x1) * tileSize, (ty - y1) * tileSize, tileSize, tileSize)
+        for layer, surface in zip(layers, drawn):
+            if layer in needed:
+                tiles.put(((*level, layer.value), tx, ty), surface.subsurface(area).copy())
+
+def _draw_tiles(view: pygame.Rect) -> None:
+    level = (zoom, *_canvas())
+    sx, sy = _tile_shift()
+    columns = range((view.left - sx) // tileSize, (view.right - 1 - sx) // tileSize + 1)
+    rows = range((view.top - sy) // tileSize, (view.bottom - 1 - sy) // tileSize + 1)
+    _prepare_tiles(level, columns, rows)
+    window.set_clip(view)
+
+    with profiler.phase("tiles"):
+        for ty in rows:
+            for tx in columns:
+                window.blit(_tile(level, tx, ty), (tx * tileSize + sx, ty * tileSize + sy))
+
+    window.set_clip(None)
+
+def _draw_padded(view: pygame.Rect) -> None:
+    global canvasSize
+    global canvasOrigin
+
+    saved = (canvasSize, canvasOrigin)
+    pad = stroke_padding()
+    canvasSize = _canvas()
+    canvasOrigin = (canvasOrigin[0] + view.left - pad, canvasOrigin[1] + view.top - pad)
+    padded = pygame.Surface((view.width + pad * 2, view.height + pad * 2), 0, window)
+    profiler.count("surfaces")
+    try:
+        _draw_layers(padded.get_rect(), {Layer.ALL: padded})
+    finally:
+        canvasSize, canvasOrigin = saved
+    window.blit(padded, view, (pad, pad, *view.size))
+
+def draw_frame() -> list[pygame.Rect] | None:
+    global redrawAll
+
+    if redrawAll or not redrawOnDemand:
+        rects = None
+        view = window.get_rect()
+    else:
+        if not dirtyRects: return []
+        rects = dirtyRects.copy()
+        view = rects[0].unionall(rects[1:])
+
+    if tiles is not None: _draw_tiles(view)
+    elif rects is None: _draw_layers(view, {Layer.ALL: window})
+    else: _draw_padded(view)
+
+    redrawAll = False
+    dirtyRects.clear()
+    return rects
@@ -0,0 +1,130 @@
+import pygame, typing, shutil, tempfile
+from collections import OrderedDict
+from pathlib import Path
+
+TileLevel = tuple[float, int, int, int]
+TileKey = tuple[TileLevel, int, int]
+
+def _tile_bytes(tile: pygame.Surface) -> int:
+    return tile.get_pitch() * tile.get_height()
+
+class TileCache:
+    def __init__(self: typing.Self, template: pygame.Surface, budget: int,
+                 diskBudget: int, directory: str = "") -> None:
+        self.template = template
+        self.budget = budget
+        self.diskBudget = diskBudget
+        self.root = directory
+        self.directory: Path | None = None
+        self.memory: OrderedDict[TileKey, pygame.Surface] = OrderedDict()
+        self.memoryBytes: int = 0
+        self.disk: OrderedDict[TileKey, tuple[tuple[int, int], int, int]] = OrderedDict()
+        self.diskBytes: int = 0
+        self.levelTiles: dict[TileLevel, set[tuple[int, int]]] = {}
+
+    def __len__(self: typing.Self) -> int:
+        return len(self.memory.keys() | self.disk.keys())
+
+    def _path(self: typing.Self, key: TileKey) -> Path:
+        if self.directory is None:
+            if self.root: Path(self.root).mkdir(parents=True, exist_ok=True)
+            self.directory = Path(tempfile.mkdtemp(prefix="kmetromaker-tiles-",
+                                                   dir=self.root or None))
+        (zoom, width, height, layer), tx, ty = key
+        return self.directory.joinpath(f"{zoom!r}_{width}x{height}_{layer}_{tx}_{ty}.tile")
+
+    def get(self: typing.Self, key: TileKey) -> pygame.Surface | None:
+        tile = self.memory.get(key)
+        if tile is not None:
+            self.memory.move_to_end(key)
+            return tile
+        stored = self.disk.get(key)
+        if stored is None: return None
+
+        try:
+            data = self._path(key).read_bytes()
+            size, flags, _ = stored
+            tile = pygame.Surface(size, flags) if flags else pygame.Surface(size, 0, self.template)
+            tile.get_buffer().write(data, 0)
+        except (OSError, ValueError):
+            self._forget(key)
+            return None
+        self.disk.move_to_end(key)
+        self._keep(key, tile)
+        return tile
+
+    def put(self: typing.Self, key: TileKey, tile: pygame.Surface) -> None:
+        self._forget(key)
+        self._keep(key, tile)
+
+    def _keep(self: typing.Self, key: TileKey, tile: pygame.Surface) -> None:
+        self.memory[key] = tile
+        self.memoryBytes += _tile_bytes(tile)
+        self.levelTiles.setdefault(key[0], set()).add(key[1:])
+        while self.memoryBytes > self.budget and len(self.memory) > 1:
+            old, surface = self.memory.popitem(last=False)
+            self.memoryBytes -= _tile_bytes(surface)
+            if old not in self.disk: self._store(old, surface)
+            self._unindex(old)
+
+    def _unindex(self: typing.Self, key: TileKey) -> None:
+        if key in self.memory or key in self.disk: return
+        tiles = self.levelTiles.get(key[0])
+        if tiles is None: return
+        tiles.discard(key[1:])
+        if not tiles: del self.levelTiles[key[0]]
+
+    def _store(self: typing.Self, key: TileKey, tile: pygame.Surface) -> None:
+        data = tile.get_buffer().raw
+        if len(data) > self.diskBudget: return
+        try:
+            self._path(key).write_bytes(data)
+        except OSError:
+            return
+        self.disk[key] = (tile.get_size(), tile.get_flags() & pygame.SRCALPHA, len(data))
+        self.diskBytes += len(data)
+        while self.diskBytes > self.diskBudget:
+            old = next(iter(self.disk))
+            self._unstore(old)
+            self._unindex(old)
+
+    def _forget(self: typing.Self, key: TileKey) -> None:
+        tile = self.memory.pop(key, None)
+        if tile is not None: self.memoryBytes -= _tile_bytes(tile)
+        self._unstore(key)
+        self._unindex(key)
+
+    def _unstore(self: typing.Self, key: TileKey) -> None:
+        stored = self.disk.pop(key, None)
+        if stored is None: return
+        self.diskBytes -= stored[2]
+        self._path(key).unlink(missing_ok=True)
+
+    def levels(self: typing.Self) -> set[TileLevel]:
+        return set(self.levelTiles)
+
+    def discard(self: typing.Self, level: TileLevel,
+                area: tuple[int, int, int, int] | None = None) -> None:
+        tiles = self.levelTiles.get(level)
+        if not tiles: return
+        if area is None:
+            found = list(tiles)
+        else:
+            x1, y1, x2, y2 = area
+            if (x2 - x1 + 1) * (y2 - y1 + 1) < len(tiles):
+                found = [(tx, ty) for tx in range(x1, x2 + 1) for ty in range(y1, y2 + 1)
+                         if (tx, ty) in tiles]
+            else:
+                found = [(tx, ty) for tx, ty in tiles if x1 <= tx <= x2 and y1 <= ty <= y2]
+        for tx, ty in found:
+            self._forget((level, tx, ty))
+
+    def clear(self: typing.Self) -> None:
+        self.memory.clear()
+        self.memoryBytes = 0
+        self.disk.clear()
+        self.diskBytes = 0
+        self.levelTiles.clear()
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
@@ -0,0 +1,108 @@
+import pygame, json, time, typing, statistics
+from collections import deque
+
+TRACE_VERSION = 1
+
+keyCodes: tuple[int, ...] = tuple(sorted({getattr(pygame, name) for name in dir(pygame)
+                                           if name.startswith("K_")}))
+
+def _plain(value: typing.Any) -> bool:
+    if value is None or isinstance(value, (bool, int, float, str)): return True
+    if isinstance(value, (tuple, list)): return all(_plain(item) for item in value)
+    return False
+
+def _event_record(event: pygame.event.Event) -> list:
+    return [event.type, {key: value for key, value in event.dict.items() if _plain(value)}]
+
+def _event(record: list) -> pygame.event.Event:
+    kind, attributes = record
+    return pygame.event.Event(kind, {key: tuple(value) if isinstance(value, list) else value
+                                     for key, value in attributes.items()})
+
+class PressedKeys:
+    def __init__(self: typing.Self, pressed: typing.Iterable[int]) -> None:
+        self.pressed = frozenset(pressed)
+
+    def __getitem__(self: typing.Self, key: int) -> bool:
+        return key in self.pressed
+
+class Recorder:
+    def __init__(self: typing.Self, filename: str, seed: int) -> None:
+        self.file = open(filename, "w")
+        self.start = time.perf_counter()
+        self._write({"version": TRACE_VERSION, "seed": seed})
+
+    def _write(self: typing.Self, record: dict[str, typing.Any]) -> None:
+        self.file.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def record_input(self: typing.Self, events: list[pygame.event.Event],
+                     keys: typing.Any, buttons: tuple[bool, ...],
+                     pos: tuple[int, int]) -> None:
+        events = [event for event in events if event.type != pygame.NOEVENT]
+        if not events: return
+        self._write({"time": round(time.perf_counter() - self.start, 6),
+                     "events": [_event_record(event) for event in events],
+                     "keys": [key for key in keyCodes if keys[key]],
+                     "buttons": list(buttons), "pos": list(pos)})
+
+    def record_answer(self: typing.Self, dialog: str, answer: typing.Any) -> None:
+        self._write({"dialog": dialog, "answer": answer if _plain(answer) else None})
+
+    def record_io(self: typing.Self) -> None:
+        self._write({"io": True})
+
+    def close(self: typing.Self) -> None:
+        self.file.close()
+
+class Replayer:
+    def __init__(self: typing.Self, filename: str) -> None:
+        with open(filename) as file:
+            records = [json.loads(line) for line in file if line.strip()]
+        if not records or records[0].get("version") != TRACE_VERSION:
+            raise ValueError("not a KMetroMaker trace")
+        self.seed: int = records[0]["seed"]
+        self.records: deque[dict[str, typing.Any]] = deque(records[1:])
+        self.latencies: list[tuple[int, float]] = []
+
+    def __len__(self: typing.Self) -> int:
+        return len(self.records)
+
+    def next(self: typing.Self) -> dict[str, typing.Any]:
+        record = self.records.popleft()
+        if "dialog" in record:
+            raise ValueError(f"the trace answers a dialog ({record['dialog']}) that was not shown")
+        return record
+
+    def input(self: typing.Self, record: dict[str, typing.Any]) -> tuple:
+        return ([_event(event) for event in record["events"]], PressedKeys(record["keys"]),
+                tuple(record["buttons"]), tuple(record["pos"]))
+
+    def answer(self: typing.Self, dialog: str) -> typing.Any:
+        if not self.records or self.records[0].get("dialog") != dialog:
+            raise ValueError(f"a dialog ({dialog}) was shown that the trace does not answer")
+        return self.records.popleft()["answer"]
+
+    def measure(self: typing.Self, record: dict[str, typing.Any], latency: float) -> None:
+        self.latencies += [(event[0], latency) for event in record["events"]]
+
+    def report(self: typing.Self, total: float) -> list[str]:
+        kinds: dict[int, list[float]] = {}
+        for kind, latency in self.latencies:
+            kinds.setdefault(kind, []).append(latency)
+
+        lines = [f"{'event':<20}{'count':>8}{'mean':>10}{'p50':>10}{'p95':>10}{'max':>10}"]
+        for kind, latencies in sorted(kinds.items(), key=lambda item: -sum(item[1])):
+            latencies.sort()
+            lines.append(f"{pygame.event.event_name(kind):<20}{len(latencies):>8}"
+                         f"{statistics.fmean(latencies) * 1000:>10.2f}"
+                         f"{latencies[len(latencies) // 2] * 1000:>10.2f}"
+                         f"{latencies[min(len(latencies) - 1, len(latencies) * 95 // 100)] * 1000:>10.2f}"
+                         f"{latencies[-1] * 1000:>10.2f}")
+        lines.append(f"{len(self.latencies)} events replayed in {total:.3f} s (latencies in ms)")
+        return lines
+
+    def write_csv(self: typing.Self, filename: str) -> None:
+        with open(filename, "w") as file:
+            file.write("event,latency_ms\n")
+            for kind, latency in self.latencies:
+                file.write(f"{pygame.event.event_name(kind)},{latency * 1000:.3f}\n")
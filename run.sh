@@ -16,4 +16,4 @@ ask-config() {
 cd "$(dirname "$0")" || fatal "cd failed, somehow..."
 [[ -e config.toml ]] || ask-config
 [[ -e metro.py ]] || fatal "metro.py is missing, has it been deleted?"
-python3 metro.py
\ No newline at end of file
+python3 metro.py "$@"
\ No newline at end of file